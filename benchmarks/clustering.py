@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the clustering backends of ``MDR.hcluster`` as the number of children grows.
+
+The similarity matrices are made of blocks of similar records with some noise,
+each backend runs in its own process so its peak memory can be measured.
+
+    python benchmarks/clustering.py 100 500 1000 2000
+"""
+import resource
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from mdr.cluster import BACKENDS
+
+def similarity_matrix(n, n_clusters=5, seed=0):
+    rng = np.random.RandomState(seed)
+    labels = rng.randint(n_clusters, size=n)
+    m = np.where(labels[:, None] == labels[None, :], 0.8, 0.2)
+    m += rng.uniform(-0.1, 0.1, size=(n, n))
+    m = (m + m.T) / 2
+    np.fill_diagonal(m, 1)
+    return m
+
+def run(args):
+    name, n = args
+    m = similarity_matrix(n)
+    # the memory of the scipy import is not counted
+    import scipy.cluster.hierarchy
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    clusters = BACKENDS[name]()(m, 0.5)
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    return name, n, elapsed, peak, len(set(clusters))
+
+def main(sizes):
+    print '%-10s %6s %10s %12s %9s' % ('backend', 'n', 'time (s)', 'memory (KB)', 'clusters')
+    for n in sizes:
+        for name in sorted(BACKENDS):
+            # a fresh process per run, maxrss never goes down
+            pool = Pool(1, maxtasksperchild=1)
+            try:
+                print '%-10s %6d %10.3f %12d %9d' % pool.apply(run, ((name, n),))
+            finally:
+                pool.close()
+                pool.join()
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [100, 250, 500, 1000, 2000])
@@ -1,51 +1,1134 @@
 cimport cython
 import numpy as np
 cimport numpy as np
+from libc.stdlib cimport malloc, calloc, realloc, free
+from cpython.pythread cimport (PyThread_type_lock, PyThread_allocate_lock, PyThread_free_lock,
+                               PyThread_acquire_lock, PyThread_release_lock, WAIT_LOCK)
+
+ctypedef unsigned long long hash_t
+
+np.import_array()
+
+cdef struct TreeBuf:
+    # raw views of the arrays of a ``CompactTree``, usable without the GIL.
+    int* tags
+    int* sizes
+    int* child_offsets
+    int* children
+    int* classes
+    int* itemprops
+    hash_t* hashes
+    hash_t* class_hashes
+    int* sorted_child_tags
+
+cdef struct Scratch:
+    # a DP buffer shared by all the levels of one recursive match,
+    # each level takes two rows on top of its caller.
+    void* data
+    Py_ssize_t top
+
+# interned tag and attribute value tables shared by all the compact trees,
+# so that tags can be compared as integers.
+_tag_ids = {}
+_tag_names = []
+_tag_hashes = []
+_value_ids = {}
+_value_hashes = [0]
+
+def stable_hash(s):
+    """
+    64 bits FNV-1a hash of a string, unlike ``hash`` it's the same in every process.
+
+    >>> stable_hash('div')
+    14602985670603331720L
+    """
+    cdef hash_t h = 14695981039346656037ULL
+    cdef unsigned char c
+    if isinstance(s, unicode):
+        s = s.encode('utf8')
+    for c in bytearray(s):
+        h = (h ^ c) * 1099511628211ULL
+    return h
+
+cdef inline hash_t _mix(hash_t x) nogil:
+    # the finalizer of splitmix64
+    x ^= x >> 30
+    x *= 0xbf58476d1ce4e5b9ULL
+    x ^= x >> 27
+    x *= 0x94d049bb133111ebULL
+    x ^= x >> 31
+    return x
+
+cdef inline hash_t _combine(hash_t h, hash_t child) nogil:
+    return _mix(h ^ (child + 0x9e3779b97f4a7c15ULL + (h << 6) + (h >> 2)))
+
+def intern_tag(tag):
+    """
+    get the integer id of the given tag.
+
+    >>> intern_tag('div') == intern_tag('div')
+    True
+    >>> intern_tag('div') == intern_tag('span')
+    False
+    """
+    try:
+        return _tag_ids[tag]
+    except KeyError:
+        _tag_ids[tag] = len(_tag_names)
+        _tag_names.append(tag)
+        # comments, processing instructions and entities use a factory as tag
+        _tag_hashes.append(stable_hash(tag if isinstance(tag, basestring) else '#' + tag.__name__))
+        return _tag_ids[tag]
+
+def intern_value(value):
+    """
+    get the integer id of the given attribute value, 0 is reserved for the empty value.
+
+    >>> intern_value(None), intern_value('')
+    (0, 0)
+    >>> intern_value('price') == intern_value('price') > 0
+    True
+    """
+    if not value:
+        return 0
+    try:
+        return _value_ids[value]
+    except KeyError:
+        _value_ids[value] = len(_value_hashes)
+        _value_hashes.append(stable_hash(value))
+        return _value_ids[value]
+
+cdef class CompactTree:
+    """
+    An array based encoding of a DOM tree.
+
+    The nodes are numbered in preorder, so node 0 is the root and the subtree of
+    node ``i`` covers the nodes ``i`` to ``i + sizes[i] - 1``.
+
+    Attributes
+    ----------
+    elements: list
+        the original element of each node.
+    tags: array
+        the interned tag id of each node.
+    sizes: array
+        the subtree size of each node.
+    parents: array
+        the parent of each node, -1 for the root.
+    child_offsets, children: array
+        the children of node ``i`` are ``children[child_offsets[i]:child_offsets[i + 1]]``.
+    classes, itemprops: array
+        the interned ``class`` and ``itemprop`` attribute of each node.
+    hashes: array
+        the structural fingerprint of the subtree of each node, i.e. a hash of the tags
+        and the shape of the subtree. Subtrees with the same shape have the same
+        fingerprint in every tree and every process.
+    class_hashes: array
+        same as ``hashes`` but also covers the ``class`` and ``itemprop`` attributes.
+    sorted_child_tags: array
+        the tags of the children of node ``i`` in ascending order are
+        ``sorted_child_tags[child_offsets[i]:child_offsets[i + 1]]``.
+
+    >>> from lxml import etree
+    >>> t = CompactTree(etree.XML("<p><a><b/></a><c/></p>"))
+    >>> len(t)
+    4
+    >>> [e.tag for e in t.elements]
+    ['p', 'a', 'b', 'c']
+    >>> t.sizes.tolist()
+    [4, 2, 1, 1]
+    >>> t.child_nodes(0).tolist()
+    [1, 3]
+    >>> t.hashes[1] == CompactTree(etree.XML("<a><b/></a>")).hashes[0]
+    True
+    """
+    cdef readonly list elements
+    cdef readonly object tags, sizes, parents, child_offsets, children, classes, itemprops
+    cdef readonly object hashes, class_hashes, sorted_child_tags
+
+    cdef TreeBuf buf
+
+    def __init__(self, element):
+        cdef int i, k, n
+        cdef int[::1] _parents, _sizes, _counts, _filled, _children, _offsets
+        cdef hash_t[::1] _hashes, _class_hashes, _class_values, _itemprop_values
+        cdef hash_t h, hc
+
+        cdef int[::1] _counts_left, _stack
+        cdef int top
+
+        # iter() is in preorder, the parent of each node is found back from the
+        # number of children of the nodes before it.
+        elements = list(element.iter())
+        n = len(elements)
+        self.elements = elements
+        self.parents = np.empty(n, np.intc)
+        child_counts = np.array([len(e) for e in elements], np.intc)
+        _parents = self.parents
+        _counts_left = child_counts.copy()
+        _stack = np.empty(n, np.intc)
+        top = -1
+        for i in range(n):
+            while top >= 0 and _counts_left[_stack[top]] == 0:
+                top -= 1
+            if top >= 0:
+                _parents[i] = _stack[top]
+                _counts_left[_stack[top]] -= 1
+            else:
+                _parents[i] = -1
+            top += 1
+            _stack[top] = i
+
+        tag_ids = [intern_tag(e.tag) for e in elements]
+        class_ids = [intern_value(e.get('class')) for e in elements]
+        itemprop_ids = [intern_value(e.get('itemprop')) for e in elements]
+        self.tags = np.array(tag_ids, np.intc)
+        self.classes = np.array(class_ids, np.intc)
+        self.itemprops = np.array(itemprop_ids, np.intc)
+
+        self.sizes = np.ones(n, np.intc)
+        counts = np.zeros(n + 1, np.intc)
+        _parents = self.parents
+        _sizes = self.sizes
+        _counts = counts
+        for i in range(n - 1, 0, -1):
+            _sizes[_parents[i]] += _sizes[i]
+            _counts[_parents[i] + 1] += 1
+        self.child_offsets = np.cumsum(counts).astype(np.intc)
+
+        # nodes are numbered in preorder, so the children are filled in order.
+        self.children = np.zeros(max(n - 1, 0), np.intc)
+        _children = self.children
+        _filled = self.child_offsets[:-1].copy()
+        for i in range(1, n):
+            _children[_filled[_parents[i]]] = i
+            _filled[_parents[i]] += 1
+
+        # the children are grouped by parent already, sort the tags within each group
+        child_tags = self.tags[self.children]
+        self.sorted_child_tags = child_tags[np.lexsort((child_tags, self.parents[self.children]))]
+
+        # children come after their parent, so the fingerprints are done backward.
+        self.hashes = np.array([_tag_hashes[t] for t in tag_ids], np.uint64)
+        self.class_hashes = np.zeros(n, np.uint64)
+        _class_values = np.array([_value_hashes[v] for v in class_ids], np.uint64)
+        _itemprop_values = np.array([_value_hashes[v] for v in itemprop_ids], np.uint64)
+        _hashes = self.hashes
+        _class_hashes = self.class_hashes
+        _offsets = self.child_offsets
+        for i in range(n - 1, -1, -1):
+            h = _hashes[i]
+            hc = _combine(_combine(h, _class_values[i]), _itemprop_values[i])
+            for k in range(_offsets[i], _offsets[i + 1]):
+                h = _combine(h, _hashes[_children[k]])
+                hc = _combine(hc, _class_hashes[_children[k]])
+            _hashes[i] = _combine(h, _offsets[i + 1] - _offsets[i])
+            _class_hashes[i] = _combine(hc, _offsets[i + 1] - _offsets[i])
+
+        self.buf.tags = <int*> np.PyArray_DATA(self.tags)
+        self.buf.sizes = <int*> np.PyArray_DATA(self.sizes)
+        self.buf.child_offsets = <int*> np.PyArray_DATA(self.child_offsets)
+        self.buf.children = <int*> np.PyArray_DATA(self.children)
+        self.buf.classes = <int*> np.PyArray_DATA(self.classes)
+        self.buf.itemprops = <int*> np.PyArray_DATA(self.itemprops)
+        self.buf.hashes = <hash_t*> np.PyArray_DATA(self.hashes)
+        self.buf.class_hashes = <hash_t*> np.PyArray_DATA(self.class_hashes)
+        self.buf.sorted_child_tags = <int*> np.PyArray_DATA(self.sorted_child_tags)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def path_hashes(self):
+        """
+        get the hash of the tag path from the root to each node.
+
+        >>> from lxml import etree
+        >>> t = CompactTree(etree.XML("<p><a><b/></a><a><b/><c/></a></p>"))
+        >>> h = t.path_hashes()
+        >>> h[2] == h[4], h[2] == h[5]
+        (True, False)
+        """
+        cdef int i
+        cdef hash_t[::1] _paths
+        cdef int[::1] _parents = self.parents
+
+        paths = np.array(_tag_hashes, np.uint64)[self.tags]
+        _paths = paths
+        for i in range(1, len(self.elements)):
+            _paths[i] = _combine(_paths[_parents[i]], _paths[i])
+        return paths
+
+    def child_nodes(self, int i):
+        """
+        get the children of the given node.
+        """
+        return self.children[self.child_offsets[i]:self.child_offsets[i + 1]]
+
+cdef enum:
+    _SIMPLE_TREE_MATCH = 1
+    _CLUSTERED_TREE_MATCH = 2
+    _TREE_ALIGNMENT = 3
+
+# the kinds of results kept in ``SimilarityMemo``
+SIMPLE_TREE_MATCH = _SIMPLE_TREE_MATCH
+CLUSTERED_TREE_MATCH = _CLUSTERED_TREE_MATCH
+TREE_ALIGNMENT = _TREE_ALIGNMENT
+
+cdef struct MemoEntry:
+    hash_t h1
+    hash_t h2
+    double c1
+    double c2
+    int kind
+    double value
+    # the LRU list and the bucket chain
+    int prev
+    int next
+    int chain
+
+cdef struct MemoShard:
+    MemoEntry* entries
+    int* buckets
+    int capacity
+    int mask
+    int count
+    int head
+    int tail
+    unsigned long long hits
+    unsigned long long misses
+    unsigned long long evictions
+    PyThread_type_lock lock
+
+cdef struct Memo:
+    # the shards are picked by the high bits of the hash of the key
+    MemoShard* shards
+    int n_shards
+
+# the default number of shards of a ``SimilarityMemo``, each one with at least
+# ``_MIN_SHARD_CAPACITY`` entries so that the LRU order of small memos stays exact
+cdef enum:
+    _MAX_SHARDS = 16
+    _MIN_SHARD_CAPACITY = 4096
+
+cdef class SimilarityMemo:
+    """
+    A LRU cache of tree match results keyed by the structural fingerprints of the subtrees.
+
+    The DOM of listing pages is very repetitive, with the memo the matchers only
+    compute the match of two subtrees once per shape and look it up afterwards.
+    The memo is used without the GIL and can be shared by several threads.
+
+    The results are split in shards by the hash of their key, each shard has its
+    own lock and LRU list so the threads rarely wait for each other. A full shard
+    evicts its least recently used result.
+
+    Two different subtrees might share the same 64 bits fingerprint, the odds are
+    negligible for the trees of a page.
+
+    Parameters
+    ----------
+    capacity: int
+        the maximum number of results kept.
+
+    shards: int, optional
+        the number of shards, a power of 2. By default up to 16 shards of at least
+        4096 results.
+
+    >>> memo = SimilarityMemo(2)
+    >>> memo.set(SIMPLE_TREE_MATCH, 1, 2, value=3)
+    >>> memo.get(SIMPLE_TREE_MATCH, 1, 2), memo.get(SIMPLE_TREE_MATCH, 2, 1)
+    (3.0, None)
+    >>> memo.set(SIMPLE_TREE_MATCH, 2, 1, value=4)
+    >>> memo.set(SIMPLE_TREE_MATCH, 3, 1, value=5)
+    >>> memo.get(SIMPLE_TREE_MATCH, 1, 2) is None, len(memo)
+    (True, 2)
+    >>> sorted(memo.stats().items())
+    [('capacity', 2), ('evictions', 1), ('hits', 1), ('misses', 2), ('size', 2)]
+    >>> memo = SimilarityMemo(10, shards=4)
+    >>> for i in range(10):
+    ...     memo.set(SIMPLE_TREE_MATCH, i, i, value=i)
+    >>> memo.shards, memo.capacity, len(memo) + memo.evictions
+    (4, 10, 10)
+    """
+    cdef Memo memo
+
+    def __cinit__(self, int capacity=65536, shards=None):
+        cdef int i, n_shards, size, buckets
+        cdef MemoShard* shard
+        if capacity < 1:
+            raise ValueError('capacity must be positive')
+        if shards is None:
+            n_shards = 1
+            while n_shards < _MAX_SHARDS and 2 * n_shards * _MIN_SHARD_CAPACITY <= capacity:
+                n_shards *= 2
+        else:
+            n_shards = shards
+            if n_shards < 1 or n_shards & (n_shards - 1) or n_shards > capacity:
+                raise ValueError('shards must be a power of 2 not above the capacity')
+        self.memo.shards = <MemoShard*> calloc(n_shards, sizeof(MemoShard))
+        if self.memo.shards == NULL:
+            raise MemoryError()
+        self.memo.n_shards = n_shards
+        for i in range(n_shards):
+            shard = &self.memo.shards[i]
+            size = capacity // n_shards + (i < capacity % n_shards)
+            buckets = 1
+            while buckets < 2 * size:
+                buckets *= 2
+            shard.entries = <MemoEntry*> malloc(size * sizeof(MemoEntry))
+            shard.buckets = <int*> malloc(buckets * sizeof(int))
+            shard.lock = PyThread_allocate_lock()
+            if shard.entries == NULL or shard.buckets == NULL or shard.lock == NULL:
+                raise MemoryError()
+            shard.capacity = size
+            shard.mask = buckets - 1
+        self.clear()
+
+    def __dealloc__(self):
+        cdef int i
+        if self.memo.shards == NULL:
+            return
+        for i in range(self.memo.n_shards):
+            free(self.memo.shards[i].entries)
+            free(self.memo.shards[i].buckets)
+            if self.memo.shards[i].lock != NULL:
+                PyThread_free_lock(self.memo.shards[i].lock)
+        free(self.memo.shards)
+
+    def __len__(self):
+        return sum([self.memo.shards[i].count for i in range(self.memo.n_shards)])
+
+    property capacity:
+        def __get__(self):
+            return sum([self.memo.shards[i].capacity for i in range(self.memo.n_shards)])
+
+    property shards:
+        def __get__(self):
+            return self.memo.n_shards
+
+    property hits:
+        def __get__(self):
+            return sum([int(self.memo.shards[i].hits) for i in range(self.memo.n_shards)])
+
+    property misses:
+        def __get__(self):
+            return sum([int(self.memo.shards[i].misses) for i in range(self.memo.n_shards)])
+
+    property evictions:
+        def __get__(self):
+            return sum([int(self.memo.shards[i].evictions) for i in range(self.memo.n_shards)])
+
+    def stats(self):
+        """
+        get the hit and miss statistics of the memo.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self), 'capacity': self.capacity}
+
+    def clear(self):
+        """
+        remove all the results and reset the statistics.
+        """
+        cdef int i, j
+        cdef MemoShard* shard
+        for i in range(self.memo.n_shards):
+            shard = &self.memo.shards[i]
+            PyThread_acquire_lock(shard.lock, WAIT_LOCK)
+            for j in range(shard.mask + 1):
+                shard.buckets[j] = -1
+            shard.count = 0
+            shard.head = shard.tail = -1
+            shard.hits = shard.misses = shard.evictions = 0
+            PyThread_release_lock(shard.lock)
+
+    def get(self, int kind, hash_t h1, hash_t h2, double c1=0, double c2=0):
+        """
+        get the result of the given kind for the subtrees with fingerprints
+        ``h1`` and ``h2``, None if it's not in the memo.
+        """
+        cdef double value
+        if _memo_get(&self.memo, kind, h1, h2, c1, c2, &value):
+            return value
+        return None
+
+    def set(self, int kind, hash_t h1, hash_t h2, double c1=0, double c2=0, double value=0):
+        """
+        keep the result of the given kind for the subtrees with fingerprints ``h1`` and ``h2``.
+        """
+        _memo_set(&self.memo, kind, h1, h2, c1, c2, value)
+
+cdef inline Memo* _memo_ptr(SimilarityMemo memo):
+    if memo is None:
+        return NULL
+    return &memo.memo
+
+cdef inline hash_t _memo_hash(int kind, hash_t h1, hash_t h2, double c1, double c2) nogil:
+    return _combine(_combine(_combine(_mix(h1 + <hash_t> kind), h2), <hash_t> c1), <hash_t> c2)
+
+cdef inline MemoShard* _memo_shard(Memo* memo, hash_t h) nogil:
+    return &memo.shards[<int> (h >> 48) & (memo.n_shards - 1)]
+
+cdef void _memo_unlink(MemoShard* memo, int k) nogil:
+    cdef MemoEntry* e = &memo.entries[k]
+    if e.prev >= 0:
+        memo.entries[e.prev].next = e.next
+    else:
+        memo.head = e.next
+    if e.next >= 0:
+        memo.entries[e.next].prev = e.prev
+    else:
+        memo.tail = e.prev
+
+cdef void _memo_push(MemoShard* memo, int k) nogil:
+    memo.entries[k].prev = -1
+    memo.entries[k].next = memo.head
+    if memo.head >= 0:
+        memo.entries[memo.head].prev = k
+    memo.head = k
+    if memo.tail < 0:
+        memo.tail = k
+
+cdef bint _memo_get(Memo* memo, int kind, hash_t h1, hash_t h2, double c1, double c2, double* value) nogil:
+    cdef int k
+    cdef MemoEntry* e
+    cdef hash_t h = _memo_hash(kind, h1, h2, c1, c2)
+    cdef MemoShard* shard = _memo_shard(memo, h)
+    PyThread_acquire_lock(shard.lock, WAIT_LOCK)
+    k = shard.buckets[<int> (h & shard.mask)]
+    while k >= 0:
+        e = &shard.entries[k]
+        if e.h1 == h1 and e.h2 == h2 and e.kind == kind and e.c1 == c1 and e.c2 == c2:
+            value[0] = e.value
+            shard.hits += 1
+            if shard.head != k:
+                _memo_unlink(shard, k)
+                _memo_push(shard, k)
+            PyThread_release_lock(shard.lock)
+            return True
+        k = e.chain
+    shard.misses += 1
+    PyThread_release_lock(shard.lock)
+    return False
+
+cdef void _memo_set(Memo* memo, int kind, hash_t h1, hash_t h2, double c1, double c2, double value) nogil:
+    cdef int k
+    cdef int* p
+    cdef MemoEntry* e
+    cdef hash_t h = _memo_hash(kind, h1, h2, c1, c2)
+    cdef MemoShard* shard = _memo_shard(memo, h)
+    PyThread_acquire_lock(shard.lock, WAIT_LOCK)
+    if shard.count < shard.capacity:
+        k = shard.count
+        shard.count += 1
+    else:
+        # evict the least recently used entry of the shard
+        k = shard.tail
+        _memo_unlink(shard, k)
+        e = &shard.entries[k]
+        p = &shard.buckets[<int> (_memo_hash(e.kind, e.h1, e.h2, e.c1, e.c2) & shard.mask)]
+        while p[0] != k:
+            p = &shard.entries[p[0]].chain
+        p[0] = e.chain
+        shard.evictions += 1
+
+    e = &shard.entries[k]
+    e.h1 = h1
+    e.h2 = h2
+    e.c1 = c1
+    e.c2 = c2
+    e.kind = kind
+    e.value = value
+    e.chain = shard.buckets[<int> (h & shard.mask)]
+    shard.buckets[<int> (h & shard.mask)] = k
+    _memo_push(shard, k)
+    PyThread_release_lock(shard.lock)
 
 def tree_size(t):
+    if isinstance(t, CompactTree):
+        return int(t.sizes[0])
     if len(t) == 0:
         return 1
     return sum(tree_size(child) for child in t) + 1
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
-def _simple_tree_match(t1, t2):
+def _simple_tree_match(t1, t2, memo=None):
 
     if t1 is None or t2 is None:
         return 0
 
-    if t1.tag != t2.tag:
+    if not isinstance(t1, CompactTree):
+        t1 = CompactTree(t1)
+    if not isinstance(t2, CompactTree):
+        t2 = CompactTree(t2)
+    return compact_simple_tree_match(t1, 0, t2, 0, memo)
+
+def _clustered_tree_match(t1, t2, c1, c2, memo=None):
+
+    if t1 is None or t2 is None:
+        return 0.0
+
+    if not isinstance(t1, CompactTree):
+        t1 = CompactTree(t1)
+    if not isinstance(t2, CompactTree):
+        t2 = CompactTree(t2)
+    return compact_clustered_tree_match(t1, 0, t2, 0, c1, c2, memo)
+
+def compact_simple_tree_match(CompactTree t1, int i1, CompactTree t2, int i2, SimilarityMemo memo=None):
+    """
+    simple tree match between node ``i1`` of ``t1`` and node ``i2`` of ``t2``.
+    """
+    cdef Scratch scratch
+    cdef long result
+    cdef Memo* _memo = _memo_ptr(memo)
+
+    _scratch_init(&scratch, t2.buf.sizes[i2], sizeof(long))
+    with nogil:
+        result = _stm_kernel(&t1.buf, i1, &t2.buf, i2, &scratch, _memo)
+    free(scratch.data)
+    return result
+
+def compact_clustered_tree_match(CompactTree t1, int i1, CompactTree t2, int i2, c1=1, c2=1,
+                                 SimilarityMemo memo=None):
+    """
+    clustered tree match between node ``i1`` of ``t1`` and node ``i2`` of ``t2``.
+    """
+    cdef Scratch scratch
+    cdef double result, _c1 = c1, _c2 = c2
+    cdef Memo* _memo = _memo_ptr(memo)
+
+    _scratch_init(&scratch, t2.buf.sizes[i2], sizeof(double))
+    with nogil:
+        result = _ctm_kernel(&t1.buf, i1, &t2.buf, i2, _c1, _c2, &scratch, _memo)
+    free(scratch.data)
+    return result
+
+cdef int _check_pairs(CompactTree t, int[::1] first, int[::1] second, double[::1] out) except -1:
+    # the kernels index the buffers of the tree without any check
+    cdef Py_ssize_t k, n = len(t.elements)
+    if first.shape[0] != second.shape[0] or first.shape[0] != out.shape[0]:
+        raise ValueError('first, second and out must have the same length')
+    for k in range(first.shape[0]):
+        if not (0 <= first[k] < n and 0 <= second[k] < n):
+            raise ValueError('node %d or %d out of the %d nodes of the tree' % (first[k], second[k], n))
+    return 0
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def clustered_tree_match_pairs(CompactTree t, int[::1] first, int[::1] second, double[::1] out,
+                               SimilarityMemo memo=None):
+    """
+    set ``out[k]`` to the clustered tree match of nodes ``first[k]`` and ``second[k]`` of ``t``.
+
+    The GIL is released while matching, so disjoint pairs can be matched by several
+    threads at once.
+
+    >>> from lxml import etree
+    >>> t = CompactTree(etree.XML("<r><a><b/></a><a><b/></a></r>"))
+    >>> out = np.zeros(1)
+    >>> clustered_tree_match_pairs(t, np.array([1], np.intc), np.array([3], np.intc), out)
+    >>> out.tolist()
+    [1.0]
+    >>> clustered_tree_match_pairs(t, np.array([1], np.intc), np.array([5], np.intc), out)
+    Traceback (most recent call last):
+    ...
+    ValueError: node 1 or 5 out of the 5 nodes of the tree
+    """
+    cdef Scratch scratch
+    cdef int k, size = 1
+    cdef Memo* _memo = _memo_ptr(memo)
+
+    _check_pairs(t, first, second, out)
+    for k in range(second.shape[0]):
+        size = max(size, t.buf.sizes[second[k]])
+
+    _scratch_init(&scratch, size, sizeof(double))
+    with nogil:
+        for k in range(first.shape[0]):
+            out[k] = _ctm_kernel(&t.buf, first[k], &t.buf, second[k], 1.0, 1.0, &scratch, _memo)
+    free(scratch.data)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def clustered_tree_match_bounds(CompactTree t, int[::1] first, int[::1] second, double[::1] out):
+    """
+    set ``out[k]`` to an upper bound of the clustered tree match of nodes ``first[k]``
+    and ``second[k]`` of ``t``, computed from the tags of their children only.
+
+    The match of two subtrees under parents with ``c1`` and ``c2`` children is at
+    most ``1 / max(c1, c2)``, and only children with the same tag can be aligned,
+    so the match of two nodes with ``m`` and ``n`` children is at most the number
+    of children tags they have in common divided by ``max(m, n)``.
+
+    >>> from lxml import etree
+    >>> t = CompactTree(etree.XML("<r><a><b/><c/><c/></a><a><c/><d/></a><b/><b/></r>"))
+    >>> first, second = np.array([1, 1, 1, 8], np.intc), np.array([5, 8, 1, 9], np.intc)
+    >>> out = np.zeros(4)
+    >>> clustered_tree_match_bounds(t, first, second, out)
+    >>> out.tolist()
+    [0.3333333333333333, 0.0, 1.0, 1.0]
+    >>> clustered_tree_match_bounds(t, first, second, out[:3])
+    Traceback (most recent call last):
+    ...
+    ValueError: first, second and out must have the same length
+    """
+    cdef int k, a, b, m, n, i, j, common
+    cdef int* tags1
+    cdef int* tags2
+
+    _check_pairs(t, first, second, out)
+    with nogil:
+        for k in range(first.shape[0]):
+            a = first[k]
+            b = second[k]
+            m = t.buf.child_offsets[a + 1] - t.buf.child_offsets[a]
+            n = t.buf.child_offsets[b + 1] - t.buf.child_offsets[b]
+            if t.buf.tags[a] != t.buf.tags[b]:
+                out[k] = 0.0
+            elif m == 0 and n == 0:
+                out[k] = 1.0
+            elif m == 0 or n == 0:
+                out[k] = 0.0
+            else:
+                # count the common tags by merging the sorted tags of the children
+                tags1 = t.buf.sorted_child_tags + t.buf.child_offsets[a]
+                tags2 = t.buf.sorted_child_tags + t.buf.child_offsets[b]
+                i = j = common = 0
+                while i < m and j < n:
+                    if tags1[i] == tags2[j]:
+                        common += 1
+                        i += 1
+                        j += 1
+                    elif tags1[i] < tags2[j]:
+                        i += 1
+                    else:
+                        j += 1
+                out[k] = common / (1.0 * max(m, n))
+
+cdef int _scratch_init(Scratch* scratch, int size, size_t itemsize) except -1:
+    # every level of the recursion descends one node in the second tree and
+    # takes 2 * (children + 1) cells, so 4 * size cells cover the deepest path.
+    scratch.top = 0
+    scratch.data = malloc((4 * size + 4) * itemsize)
+    if scratch.data == NULL:
+        raise MemoryError()
+    return 0
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef long _stm_kernel(TreeBuf* t1, int i1, TreeBuf* t2, int i2, Scratch* scratch, Memo* memo) nogil:
+    cdef int i, j, m, n, s1, s2
+    cdef long v
+    cdef double memoized
+    cdef long* prev
+    cdef long* cur
+    cdef long* swap
+
+    if t1.tags[i1] != t2.tags[i2]:
         return 0
 
-    m = np.zeros((len(t1) + 1, len(t2) + 1), np.int)
+    s1 = t1.child_offsets[i1]
+    s2 = t2.child_offsets[i2]
+    m = t1.child_offsets[i1 + 1] - s1
+    n = t2.child_offsets[i2 + 1] - s2
+
+    # leaves are cheaper to match than to look up
+    if memo != NULL and m and n:
+        if _memo_get(memo, _SIMPLE_TREE_MATCH, t1.hashes[i1], t2.hashes[i2], 0, 0, &memoized):
+            return <long> memoized
+
+    # only the previous row of the DP matrix is needed.
+    prev = (<long*> scratch.data) + scratch.top
+    cur = prev + n + 1
+    scratch.top += 2 * (n + 1)
 
-    for i from 1 <= i < m.shape[0]:
-        for j from 1 <= j < m.shape[1]:
-            m[i, j] = max(m[i, j - 1], m[i - 1, j], m[i - 1, j - 1] + _simple_tree_match(t1[i - 1], t2[j - 1]))
-    return 1 + m[m.shape[0]-1, m.shape[1]-1]
+    for j in range(n + 1):
+        prev[j] = 0
+    cur[0] = 0
+
+    for i in range(1, m + 1):
+        for j in range(1, n + 1):
+            v = prev[j - 1] + _stm_kernel(t1, t1.children[s1 + i - 1], t2, t2.children[s2 + j - 1], scratch, memo)
+            cur[j] = max(cur[j - 1], prev[j], v)
+        swap = prev
+        prev = cur
+        cur = swap
+
+    scratch.top -= 2 * (n + 1)
+    if memo != NULL and m and n:
+        _memo_set(memo, _SIMPLE_TREE_MATCH, t1.hashes[i1], t2.hashes[i2], 0, 0, 1 + prev[n])
+    return 1 + prev[n]
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def _clustered_tree_match(t1, t2, c1, c2):
+@cython.cdivision(True)
+cdef double _ctm_kernel(TreeBuf* t1, int i1, TreeBuf* t2, int i2, double c1, double c2,
+                        Scratch* scratch, Memo* memo) nogil:
+    cdef int i, j, m, n, s1, s2
+    cdef double v, result
+    cdef double* prev
+    cdef double* cur
+    cdef double* swap
 
-    if t1 is None or t2 is None:
+    if t1.tags[i1] != t2.tags[i2]:
         return 0.0
 
-    if t1.tag != t2.tag:
-        return 0.0
+    s1 = t1.child_offsets[i1]
+    s2 = t2.child_offsets[i2]
+    m = t1.child_offsets[i1 + 1] - s1
+    n = t2.child_offsets[i2 + 1] - s2
+
+    if memo != NULL and m and n:
+        if _memo_get(memo, _CLUSTERED_TREE_MATCH, t1.hashes[i1], t2.hashes[i2], c1, c2, &result):
+            return result
 
-    m = len(t1)
-    n = len(t2)
+    prev = (<double*> scratch.data) + scratch.top
+    cur = prev + n + 1
+    scratch.top += 2 * (n + 1)
 
-    matrix = np.zeros((m+1, n+1), np.float)
+    for j in range(n + 1):
+        prev[j] = 0.0
+    cur[0] = 0.0
 
-    for i from 1 <= i < matrix.shape[0]:
-        for j from 1 <= j < matrix.shape[1]:
-            matrix[i, j] = max(matrix[i, j - 1], matrix[i - 1, j],
-                matrix[i - 1, j - 1] + _clustered_tree_match(t1[i - 1], t2[j - 1], m, n))
+    for i in range(1, m + 1):
+        for j in range(1, n + 1):
+            v = prev[j - 1] + _ctm_kernel(t1, t1.children[s1 + i - 1], t2, t2.children[s2 + j - 1], m, n,
+                                          scratch, memo)
+            cur[j] = max(cur[j - 1], prev[j], v)
+        swap = prev
+        prev = cur
+        cur = swap
+
+    scratch.top -= 2 * (n + 1)
 
     # XXX: m and n?
     if m or n:
-        return matrix[m, n] / (1.0 * max(c1, c2))
+        result = prev[n] / (1.0 * max(c1, c2))
     else:
-        return matrix[m, n] + (1.0 / max(c1, c2))
+        result = prev[n] + (1.0 / max(c1, c2))
+
+    if memo != NULL and m and n:
+        _memo_set(memo, _CLUSTERED_TREE_MATCH, t1.hashes[i1], t2.hashes[i2], c1, c2, result)
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef double _record_kernel(double[:, ::1] m, int* rows1, int n1, int* rows2, int n2, double* prev) nogil:
+    # the longest common subsequence of the two records weighted by the similarity
+    # of their trees, with two rows of the DP matrix
+    cdef int i, j
+    cdef double* cur = prev + n2 + 1
+    cdef double* swap
+
+    for j in range(n2 + 1):
+        prev[j] = 0.0
+    cur[0] = 0.0
+
+    for i in range(1, n1 + 1):
+        for j in range(1, n2 + 1):
+            cur[j] = max(cur[j - 1], prev[j], prev[j - 1] + m[rows1[i - 1], rows2[j - 1]])
+        swap = prev
+        prev = cur
+        cur = swap
+
+    return prev[n2] / max(n1 + 1, n2 + 1)
+
+def record_similarity(double[:, ::1] m):
+    """
+    get the similarity of two records from the similarity matrix ``m`` of their trees,
+    i.e. ``m[i, j]`` is the similarity of the tree ``i`` of the first record and the
+    tree ``j`` of the second one.
+
+    >>> record_similarity(np.array([[1.0, 0.0], [0.0, 0.5]]))
+    0.5
+    """
+    cdef int[::1] rows1 = np.arange(m.shape[0], dtype=np.intc)
+    cdef int[::1] rows2 = np.arange(m.shape[1], dtype=np.intc)
+    cdef double[::1] buf = np.zeros(2 * (m.shape[1] + 1))
+    return _record_kernel(m, &rows1[0], m.shape[0], &rows2[0], m.shape[1], &buf[0])
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def record_similarities(double[:, ::1] m, int[::1] rows, int[::1] starts, int[::1] lengths,
+                        int[::1] first, int[::1] second, double[::1] out):
+    """
+    set ``out[k]`` to the similarity of the records ``first[k]`` and ``second[k]``.
+
+    The records are runs of a sequence of trees: record ``r`` is the trees ``starts[r]``
+    to ``starts[r] + lengths[r] - 1``, and the similarity of the trees ``p`` and ``q`` is
+    ``m[rows[p], rows[q]]``.
+
+    >>> m = np.array([[1.0, 0.2, 0.9], [0.2, 1.0, 0.1], [0.9, 0.1, 1.0]])
+    >>> rows = np.array([0, 1, 2, 1], np.intc)
+    >>> out = np.zeros(1)
+    >>> record_similarities(m, rows, np.array([0, 2], np.intc), np.array([2, 2], np.intc),
+    ...                     np.array([0], np.intc), np.array([1], np.intc), out)
+    >>> out[0] == record_similarity(np.array([[0.9, 0.2], [0.1, 1.0]]))
+    True
+    """
+    cdef int k, a, b, width = 1
+    cdef double[::1] buf
+
+    for k in range(lengths.shape[0]):
+        width = max(width, lengths[k])
+    buf = np.zeros(2 * (width + 1))
+
+    with nogil:
+        for k in range(first.shape[0]):
+            a = first[k]
+            b = second[k]
+            out[k] = _record_kernel(m, &rows[starts[a]], lengths[a], &rows[starts[b]], lengths[b], &buf[0])
+
+cdef enum:
+    _TRACE_LEFT = 1
+    _TRACE_UP = 2
+    _TRACE_DIAG = 3
+
+cdef class CompactTreeAligner:
+    """
+    Align compact trees with simple tree matching, without building an alignment
+    per pair of subtrees.
+
+    The DP matrices take two rows of a shared scratch buffer and only the scores
+    are kept. The winning alignment is rebuilt level by level: the scores of the
+    pairs of children of an aligned pair are computed again, then its DP matrix is
+    filled and traced back, so the memory never holds more than one level. With a
+    ``memo`` the scores of the children were memoized by the level above.
+
+    The scores and the tie-breaking are the same as ``SimpleTreeAligner``: a node
+    pair scores 1 plus the alignment of its children, plus 1 for each non-empty
+    ``class`` and ``itemprop`` in common, and 0 if their tags differ.
+
+    The buffers grow with the largest pair of subtrees or child lists, ``release``
+    frees those above ``max_size`` integers. ``align`` releases them once the
+    alignment is traced back.
+
+    Parameters
+    ----------
+    memo: ``SimilarityMemo``, optional
+        keep the alignment score of the subtrees by their fingerprint, shared with
+        ``SimpleTreeAligner``.
+
+    max_size: int
+        the number of integers a buffer keeps between two alignments.
+
+    >>> from lxml import etree
+    >>> t1 = CompactTree(etree.XML("<p><a/><b/><e/></p>"))
+    >>> t2 = CompactTree(etree.XML("<p><b/><c/><e/></p>"))
+    >>> aligner = CompactTreeAligner(max_size=8)
+    >>> aligner.score(t1, 0, t2, 0), aligner.buffer_size
+    (3, 20)
+    >>> aligner.align(t1, 0, t2, 0), aligner.buffer_size
+    ((3, [(0, 0, 3), (3, 3, 1), (2, 1, 1)]), 0)
+    >>> aligner.align(t1, 0, t2, 0, score=3)
+    (3, [(0, 0, 3), (3, 3, 1), (2, 1, 1)])
+    """
+    cdef readonly SimilarityMemo memo
+    cdef readonly Py_ssize_t max_size
+    # the scores, DP and trace matrices of the level being traced back
+    cdef int* cells
+    cdef Py_ssize_t cells_size
+    cdef Scratch scratch
+    cdef Py_ssize_t scratch_size
+
+    def __cinit__(self, SimilarityMemo memo=None, Py_ssize_t max_size=1 << 20):
+        self.memo = memo
+        self.max_size = max_size
+        self.cells = NULL
+        self.scratch.data = NULL
+        self.cells_size = self.scratch_size = 0
+
+    def __dealloc__(self):
+        free(self.cells)
+        free(self.scratch.data)
+
+    property buffer_size:
+        def __get__(self):
+            return self.cells_size + self.scratch_size
+
+    def release(self):
+        """
+        free the buffers larger than ``max_size`` integers, they're allocated again when needed.
+        """
+        if self.cells_size > self.max_size:
+            free(self.cells)
+            self.cells = NULL
+            self.cells_size = 0
+        if self.scratch_size > self.max_size:
+            free(self.scratch.data)
+            self.scratch.data = NULL
+            self.scratch_size = 0
+
+    cdef int _reserve(self, int** buf, Py_ssize_t* size, Py_ssize_t n) except -1:
+        cdef int* p
+        if n > size[0]:
+            p = <int*> realloc(buf[0], n * sizeof(int))
+            if p == NULL:
+                raise MemoryError()
+            buf[0] = p
+            size[0] = n
+        return 0
+
+    def score(self, CompactTree t1, int i1, CompactTree t2, int i2):
+        """
+        get the alignment score of node ``i1`` of ``t1`` and node ``i2`` of ``t2``.
+        """
+        cdef int result
+        cdef Memo* _memo = _memo_ptr(self.memo)
+
+        self._reserve(<int**> &self.scratch.data, &self.scratch_size, 4 * t2.buf.sizes[i2] + 4)
+        self.scratch.top = 0
+        with nogil:
+            result = _sta_kernel(&t1.buf, i1, &t2.buf, i2, &self.scratch, _memo)
+        return result
+
+    def align(self, CompactTree t1, int i1, CompactTree t2, int i2, score=None):
+        """
+        align node ``i1`` of ``t1`` with node ``i2`` of ``t2``.
+
+        Parameters
+        ----------
+        score: int, optional
+            the score of the two nodes if it's already known, it isn't computed again.
+
+        Returns
+        -------
+        score: int
+            the alignment score.
+
+        pairs: list
+            the ``(node1, node2, score)`` of the aligned node pairs, starting with
+            ``(i1, i2)`` and then in the order of ``TreeAlignment.subs``. It's empty
+            if the tags of the two nodes differ.
+        """
+        result = self.score(t1, i1, t2, i2) if score is None else score
+        pairs = []
+        try:
+            if result:
+                pairs.append((i1, i2, result))
+                self._reserve(<int**> &self.scratch.data, &self.scratch_size, 4 * t2.buf.sizes[i2] + 4)
+                self._trace(&t1.buf, i1, &t2.buf, i2, pairs)
+        finally:
+            self.release()
+        return result, pairs
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef int _trace(self, TreeBuf* t1, int i1, TreeBuf* t2, int i2, list pairs) except -1:
+        cdef int i, j, m, n, s1, s2, v, width
+        cdef int* scores
+        cdef int* dp
+        cdef int* trace
+        cdef Memo* _memo = _memo_ptr(self.memo)
+
+        s1 = t1.child_offsets[i1]
+        s2 = t2.child_offsets[i2]
+        m = t1.child_offsets[i1 + 1] - s1
+        n = t2.child_offsets[i2 + 1] - s2
+        if m == 0 or n == 0:
+            return 0
+
+        # score the pairs of children of this level, then fill its DP matrix
+        width = n + 1
+        self._reserve(&self.cells, &self.cells_size, <Py_ssize_t> (m + 1) * width + 2 * m * n)
+        scores = self.cells
+        dp = scores + m * n
+        trace = dp + (m + 1) * width
+        self.scratch.top = 0
+        with nogil:
+            for i in range(m):
+                for j in range(n):
+                    scores[i * n + j] = _sta_child(t1, t1.children[s1 + i], t2, t2.children[s2 + j],
+                                                   &self.scratch, _memo)
+        for j in range(width):
+            dp[j] = 0
+        for i in range(1, m + 1):
+            dp[i * width] = 0
+            for j in range(1, n + 1):
+                if dp[i * width + j - 1] > dp[(i - 1) * width + j]:
+                    v = dp[i * width + j - 1]
+                    trace[(i - 1) * n + j - 1] = _TRACE_LEFT
+                else:
+                    v = dp[(i - 1) * width + j]
+                    trace[(i - 1) * n + j - 1] = _TRACE_UP
+                if dp[(i - 1) * width + j - 1] + scores[(i - 1) * n + j - 1] > v:
+                    v = dp[(i - 1) * width + j - 1] + scores[(i - 1) * n + j - 1]
+                    trace[(i - 1) * n + j - 1] = _TRACE_DIAG
+                dp[i * width + j] = v
+
+        diagonal = []
+        i = m - 1
+        j = n - 1
+        while i >= 0 and j >= 0:
+            if trace[i * n + j] == _TRACE_DIAG:
+                diagonal.append((t1.children[s1 + i], t2.children[s2 + j], scores[i * n + j]))
+                i -= 1
+                j -= 1
+            elif trace[i * n + j] == _TRACE_UP:
+                i -= 1
+            else:
+                j -= 1
+
+        # the cells are reused by the next levels
+        for pair in diagonal:
+            pairs.append(pair)
+            self._trace(t1, pair[0], t2, pair[1], pairs)
+        return 0
+
+cdef inline int _sta_child(TreeBuf* t1, int c1, TreeBuf* t2, int c2, Scratch* scratch, Memo* memo) nogil:
+    # the score of a pair of children, looked up in the memo when it's worth it
+    cdef double memoized
+    cdef int v
+    # leaves and different tags are cheaper to align than to look up
+    cdef bint memoizable = (memo != NULL and t1.sizes[c1] > 1 and t2.sizes[c2] > 1
+                            and t1.tags[c1] == t2.tags[c2])
+    if memoizable and _memo_get(memo, _TREE_ALIGNMENT, t1.class_hashes[c1], t2.class_hashes[c2],
+                                0, 0, &memoized):
+        return <int> memoized
+    v = _sta_kernel(t1, c1, t2, c2, scratch, memo)
+    if memoizable:
+        _memo_set(memo, _TREE_ALIGNMENT, t1.class_hashes[c1], t2.class_hashes[c2], 0, 0, v)
+    return v
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _sta_kernel(TreeBuf* t1, int i1, TreeBuf* t2, int i2, Scratch* scratch, Memo* memo) nogil:
+    # the score of the alignment of the two nodes
+    cdef int i, j, m, n, s1, s2, c1, v, result
+    cdef int* prev
+    cdef int* cur
+    cdef int* swap
+
+    if t1.tags[i1] != t2.tags[i2]:
+        return 0
+
+    s1 = t1.child_offsets[i1]
+    s2 = t2.child_offsets[i2]
+    m = t1.child_offsets[i1 + 1] - s1
+    n = t2.child_offsets[i2 + 1] - s2
+
+    prev = (<int*> scratch.data) + scratch.top
+    cur = prev + n + 1
+    scratch.top += 2 * (n + 1)
+
+    for j in range(n + 1):
+        prev[j] = 0
+    cur[0] = 0
+
+    for i in range(1, m + 1):
+        c1 = t1.children[s1 + i - 1]
+        for j in range(1, n + 1):
+            v = _sta_child(t1, c1, t2, t2.children[s2 + j - 1], scratch, memo)
+            cur[j] = max(cur[j - 1], prev[j], prev[j - 1] + v)
+        swap = prev
+        prev = cur
+        cur = swap
+
+    scratch.top -= 2 * (n + 1)
+
+    result = 1 + prev[n]
+    if t1.classes[i1] and t1.classes[i1] == t2.classes[i2]:
+        result += 1
+    if t1.itemprops[i1] and t1.itemprops[i1] == t2.itemprops[i2]:
+        result += 1
+    return result
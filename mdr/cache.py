@@ -0,0 +1,573 @@
+# -*- coding: utf-8 -*-
+import collections
+import os
+import sqlite3
+import sys
+import time
+
+from ._tree import stable_hash
+
+# the row values ``(h1, h2) IN (...)`` need sqlite 3.15, the older versions test the pairs one by one
+_ROW_VALUES = sqlite3.sqlite_version_info >= (3, 15, 0)
+
+def _to_signed(h):
+    # sqlite integers are signed 64 bits
+    h = int(h)
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+class SQLiteSimilarityCache(object):
+    """
+    A persistent cache of the clustered tree match between two subtrees, keyed by
+    the structural fingerprints of the subtrees (see ``CompactTree.hashes``).
+
+    Pages of the same template produce the same subtrees, so the similarities
+    computed for a crawl can be reused by the next ones. The cache is a SQLite
+    database in WAL mode, many processes can read and write it at the same time:
+    the lookups are plain reads, the access times of the similarities found are
+    only written when they're older than ``touch_interval``, along with the next
+    ``set_many``. The pairs are looked up with row values from SQLite 3.15 on.
+
+    Parameters
+    ----------
+    path: str
+        the path of the database file, created if not exists.
+
+    max_entries: int
+        the maximum number of similarities kept, the least recently used are removed
+        by ``compact`` once the limit is exceeded.
+
+    timeout: float
+        how long to wait for the lock of the database held by another process.
+
+    touch_interval: int
+        the number of seconds an access time is left as is, the least recently used
+        similarities are only known within this interval.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'sim.db')
+    >>> cache = SQLiteSimilarityCache(path)
+    >>> cache.set_many({(1, 2): 0.5, (2 ** 64 - 1, 3): 1.0})
+    >>> len(cache)
+    2
+    >>> cache.get_many([(2 ** 64 - 1, 3), (4, 5)])
+    {(18446744073709551615L, 3): 1.0}
+    """
+
+    # the number of keys looked up by each query, sqlite takes at most 999 parameters by default
+    batch_size = 400
+    # the number of access times kept before they're written by ``get_many`` itself
+    max_touched = 10000
+
+    def __init__(self, path, max_entries=1000000, timeout=30.0, touch_interval=3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+        # the access times to write, by signed fingerprint pair
+        self._touched = {}
+
+    @property
+    def conn(self):
+        # sqlite connections can't be shared with forked processes
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS similarity ('
+                               'h1 INTEGER NOT NULL, h2 INTEGER NOT NULL, '
+                               'value REAL NOT NULL, used INTEGER NOT NULL, '
+                               'PRIMARY KEY (h1, h2)) WITHOUT ROWID')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS similarity_used ON similarity (used)')
+            self._pid = os.getpid()
+        return self._conn
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        return state
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM similarity').fetchone()[0]
+
+    def get_many(self, keys):
+        """
+        get the similarities of the given fingerprint pairs.
+
+        Returns
+        -------
+        a dict from the fingerprint pair to the similarity, missing pairs are left out.
+        """
+        # the keys by their signed fingerprints, as stored
+        signed = dict(((_to_signed(h1), _to_signed(h2)), (h1, h2)) for h1, h2 in keys)
+        pairs = signed.keys()
+        found = {}
+        now = int(time.time())
+        cursor = self.conn.cursor()
+        # a read transaction, it doesn't take the write lock
+        cursor.execute('BEGIN')
+        try:
+            for k in xrange(0, len(pairs), self.batch_size):
+                batch = pairs[k:k + self.batch_size]
+                if _ROW_VALUES:
+                    where = '(h1, h2) IN (VALUES %s)' % ', '.join(['(?, ?)'] * len(batch))
+                else:
+                    where = ' OR '.join(['(h1 = ? AND h2 = ?)'] * len(batch))
+                rows = cursor.execute('SELECT h1, h2, value, used FROM similarity WHERE ' + where,
+                                      [h for pair in batch for h in pair])
+                for h1, h2, value, used in rows:
+                    found[h1, h2] = value
+                    if used < now - self.touch_interval:
+                        self._touched[h1, h2] = now
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+
+        if len(self._touched) >= self.max_touched:
+            self.flush()
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return dict((signed[pair], value) for pair, value in found.iteritems())
+
+    def set_many(self, items):
+        """
+        keep the similarities of the fingerprint pairs in the given dict, and write
+        the pending access times.
+        """
+        now = int(time.time())
+        self._write([(_to_signed(h1), _to_signed(h2), value, now) for (h1, h2), value in items.iteritems()])
+
+        # counting the rows is not free, check the size once in a while
+        self._writes += len(items)
+        if self._writes >= max(1, self.max_entries // 10):
+            self._writes = 0
+            if len(self) > self.max_entries:
+                self.compact()
+
+    def flush(self):
+        """
+        write the pending access times of the similarities found by ``get_many``.
+        """
+        if self._touched:
+            self._write([])
+
+    def _write(self, rows):
+        touched, self._touched = self._touched, {}
+        cursor = self.conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.executemany('INSERT OR REPLACE INTO similarity (h1, h2, value, used) VALUES (?, ?, ?, ?)', rows)
+            cursor.executemany('UPDATE similarity SET used = MAX(used, ?) WHERE h1 = ? AND h2 = ?',
+                               [(used, h1, h2) for (h1, h2), used in touched.iteritems()])
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            self._touched.update(touched)
+            raise
+
+    def compact(self, vacuum=False):
+        """
+        remove the least recently used similarities beyond ``max_entries`` and
+        reclaim the space of the write ahead log (and of the database if ``vacuum``).
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            extra = cursor.execute('SELECT COUNT(*) FROM similarity').fetchone()[0] - self.max_entries
+            if extra > 0:
+                if _ROW_VALUES:
+                    cursor.execute('DELETE FROM similarity WHERE (h1, h2) IN ('
+                                   'SELECT h1, h2 FROM similarity ORDER BY used LIMIT ?)', (extra,))
+                else:
+                    cursor.execute('DELETE FROM similarity WHERE EXISTS ('
+                                   'SELECT 1 FROM (SELECT h1, h2 FROM similarity ORDER BY used LIMIT ?) AS old '
+                                   'WHERE old.h1 = similarity.h1 AND old.h2 = similarity.h2)', (extra,))
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        if vacuum:
+            cursor.execute('VACUUM')
+
+    def stats(self):
+        """
+        get the hit and miss statistics of this process.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+class TreeSimilarityCache(object):
+    """
+    The similarities between pairs of elements of the current document.
+
+    The similarities are kept either by pair, or as whole similarity matrices so
+    that a matrix of n elements only costs an index of the elements, not n * n
+    entries.
+
+    The keys are lxml elements, which can't be weakly referenced, so the cache only
+    keeps the elements of one document: all the entries are dropped as soon as the
+    cache is bound to another document. It also holds at most ``max_size`` entries
+    (a n * n matrix counts as n * n entries), the oldest entries are evicted first.
+
+    Parameters
+    ----------
+    max_size: int
+        the maximum number of entries, the entries of a single similarity matrix are
+        never evicted by each other so a bigger matrix can exceed it.
+
+    >>> from lxml import etree
+    >>> doc = etree.XML("<ul><li/><li/><li/></ul>")
+    >>> cache = TreeSimilarityCache(max_size=4)
+    >>> cache.bind(doc)
+    >>> cache[(doc[0], doc[1])] = 0.5
+    >>> cache.get((doc[0], doc[1])), len(cache)
+    (0.5, 1)
+    >>> cache.add_matrix(doc[1:], [[1.0, 0.2], [0.2, 1.0]])
+    >>> cache.get((doc[2], doc[1])), cache.get((doc[0], doc[1])), len(cache), cache.evictions
+    (0.2, None, 4, 1)
+    >>> cache.bind(etree.XML("<ul/>"))
+    >>> len(cache)
+    0
+    """
+
+    def __init__(self, max_size=1000000):
+        self.max_size = max_size
+        self.evictions = 0
+        self._pairs = {}
+        self._matrices = []
+        # the entries in insertion order: (insertion number, pair or matrix, size)
+        self._entries = collections.deque()
+        self._size = 0
+        self._count = 0
+        self._batch = 0
+        self._document = None
+
+    def bind(self, element):
+        """
+        use the cache for the document of the given element, drop the entries of
+        the previous document if it's another one.
+        """
+        document = element.getroottree().getroot()
+        if document is not self._document:
+            self.clear()
+            self._document = document
+
+    def reserve(self, n):
+        """
+        evict the oldest entries to make room for ``n`` new entries, the entries
+        added from now on are not evicted by each other.
+        """
+        self._batch = self._count
+        self._evict(n)
+
+    def _evict(self, n):
+        while self._entries and self._size + n > self.max_size and self._entries[0][0] < self._batch:
+            _, entry, size = self._entries.popleft()
+            if isinstance(entry, tuple):
+                del self._pairs[entry]
+            else:
+                self._matrices.remove(entry)
+            self._size -= size
+            self.evictions += size
+
+    def _push(self, entry, size):
+        self._evict(size)
+        self._entries.append((self._count, entry, size))
+        self._count += 1
+        self._size += size
+
+    def add_matrix(self, elements, m, rows=None):
+        """
+        keep the similarity matrix ``m`` of ``elements``, i.e. the similarity of
+        ``elements[i]`` and ``elements[j]`` is ``m[i][j]``, or ``m[rows[i]][rows[j]]``
+        if ``rows`` is given.
+        """
+        if not len(elements):
+            return
+        self.bind(elements[0])
+        self.reserve(len(m) ** 2)
+        matrix = MatrixEntry(elements, m, rows)
+        self._matrices.append(matrix)
+        self._push(matrix, len(m) ** 2)
+
+    def clear(self):
+        self._pairs.clear()
+        del self._matrices[:]
+        self._entries.clear()
+        self._size = 0
+        self._document = None
+
+    def get(self, key, default=None):
+        value = self._pairs.get(key)
+        if value is not None:
+            return value
+        # the latest matrices are the most likely to be looked up
+        for matrix in reversed(self._matrices):
+            value = matrix.get(key)
+            if value is not None:
+                return value
+        return default
+
+    def get_matrix(self, elements):
+        """
+        get a similarity matrix covering all the given elements, with the row of each element.
+
+        Returns
+        -------
+        ``(matrix, rows)`` so that the similarity of ``elements[i]`` and ``elements[j]``
+        is ``matrix[rows[i], rows[j]]``, None if no matrix has them all.
+        """
+        for matrix in reversed(self._matrices):
+            rows = matrix.rows(elements)
+            if rows is not None:
+                return matrix.matrix, rows
+        return None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self._pairs:
+            self._push(key, 1)
+        self._pairs[key] = value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return self._size
+
+    def iteritems(self):
+        for item in self._pairs.iteritems():
+            yield item
+        for matrix in self._matrices:
+            for item in matrix.iteritems():
+                yield item
+
+    def memory_usage(self):
+        """
+        estimate the memory used by the cache in bytes, the elements are not counted.
+        """
+        size = sys.getsizeof(self._pairs) + sys.getsizeof(self._entries)
+        if self._pairs:
+            key, value = next(self._pairs.iteritems())
+            size += len(self._pairs) * (sys.getsizeof(key) + sys.getsizeof(value))
+        for matrix in self._matrices:
+            size += matrix.memory_usage()
+        return size
+
+    def stats(self):
+        return {'size': len(self), 'max_size': self.max_size, 'evictions': self.evictions,
+                'memory_usage': self.memory_usage()}
+
+class MatrixEntry(object):
+    """
+    A similarity matrix of a list of elements in ``TreeSimilarityCache``.
+    """
+    __slots__ = ('index', 'matrix')
+
+    def __init__(self, elements, matrix, rows=None):
+        if rows is None:
+            rows = range(len(elements))
+        self.index = dict(zip(elements, rows))
+        self.matrix = matrix
+
+    def get(self, key):
+        i = self.index.get(key[0])
+        j = self.index.get(key[1])
+        if i is None or j is None:
+            return None
+        return self.matrix[i][j]
+
+    def rows(self, elements):
+        rows = [self.index.get(e) for e in elements]
+        if None in rows:
+            return None
+        return rows
+
+    def iteritems(self):
+        for e1, i in self.index.iteritems():
+            for e2, j in self.index.iteritems():
+                yield (e1, e2), self.matrix[i][j]
+
+    def memory_usage(self):
+        return sys.getsizeof(self.index) + getattr(self.matrix, 'nbytes', sys.getsizeof(self.matrix))
+
+class TemplateCache(object):
+    """
+    The listing location of each page template: the xpath of the candidate and
+    the seed record extracted from it, keyed by a fingerprint of the skeleton of
+    the top of the page.
+
+    The pages of a site built from the same template have the same fingerprint, so
+    ``MDR.extract_page`` can try the cached candidate with the cached seed first
+    and only falls back to the full detection if it doesn't find the records.
+
+    Parameters
+    ----------
+    max_entries: int
+        the maximum number of templates kept, the least recently used are evicted.
+
+    depth: int
+        the depth of the skeleton in the fingerprint.
+
+    >>> from lxml import etree
+    >>> cache = TemplateCache(max_entries=1)
+    >>> doc = etree.XML('<html><body><div class="a"><ul/></div></body></html>')
+    >>> key = cache.fingerprint(doc)
+    >>> key == cache.fingerprint(etree.XML('<html><body><div class="a"><ul><li/></ul></div></body></html>'))
+    True
+    >>> key == cache.fingerprint(etree.XML('<html><body><div class="b"><ul/></div></body></html>'))
+    False
+    >>> cache.get(key) is None
+    True
+    >>> cache.set(key, '/html/body/div/ul', None)
+    >>> cache.get(key)
+    ('/html/body/div/ul', None)
+    >>> sorted(cache.stats().items())
+    [('evictions', 0), ('failures', 0), ('hit_rate', 0.5), ('hits', 1), ('misses', 1), ('size', 1)]
+    """
+
+    def __init__(self, max_entries=10000, depth=4):
+        self.max_entries = max_entries
+        self.depth = depth
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+
+    def fingerprint(self, doc):
+        """
+        the fingerprint of the template of the given document or element: the tags
+        and classes of the elements up to ``depth`` levels below the root.
+        """
+        root = doc.getroot() if hasattr(doc, 'getroot') else doc
+        tokens = []
+        level = [root]
+        for depth in range(self.depth):
+            tokens.append('|'.join('%s.%s' % (e.tag, e.get('class', '')) for e in level))
+            level = [child for e in level for child in e if isinstance(child.tag, basestring)]
+        return stable_hash('/'.join(tokens))
+
+    def get(self, key):
+        """
+        get the ``(xpath, seed record)`` of the template, None if not cached.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def set(self, key, xpath, record):
+        """
+        keep the xpath of the candidate and the seed record of the template.
+        """
+        self._entries.pop(key, None)
+        self._entries[key] = (xpath, record)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        drop the template after its cached location failed, the lookup counts as a failure.
+        """
+        if self._entries.pop(key, None) is not None:
+            self.hits -= 1
+            self.failures += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.failures
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses, 'failures': self.failures,
+                'evictions': self.evictions, 'hit_rate': self.hits / float(lookups) if lookups else 0.0}
+
+class AlignmentCache(object):
+    """
+    The alignments of the subtrees of a virtual seed with the subtrees of the records,
+    keyed by the seed node, its version and the record element.
+
+    ``RecordAligner`` aligns the records partially aligned to the seed again after
+    each modification of the seed. The version of a seed node changes when nodes
+    are inserted in its subtree, so only the alignments along the modified path of
+    the seed are invalidated and the alignments of the other subtrees are reused.
+
+    Parameters
+    ----------
+    max_entries: int
+        the maximum number of alignments kept, the cache is cleared when it's full.
+
+    >>> from lxml import etree
+    >>> from .tree import SeedNode
+    >>> seed, record = SeedNode(etree.XML('<p><a/></p>')), etree.XML('<p><a/></p>')
+    >>> cache = AlignmentCache()
+    >>> cache.set(seed, record, 'p alignment')
+    >>> cache.set(seed[0], record[0], 'a alignment')
+    >>> cache.get(seed, record)
+    'p alignment'
+    >>> seed.insert(1, SeedNode(etree.XML('<b/>')))
+    >>> cache.get(seed, record) is None, cache.get(seed[0], record[0])
+    (True, 'a alignment')
+    >>> sorted(cache.stats().items())
+    [('evictions', 0), ('hits', 2), ('misses', 1), ('size', 2)]
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}
+
+    def get(self, node, element):
+        """
+        get the alignment of the seed node with the record element, None if not cached.
+        """
+        alignment = self._entries.get((node, node.version, element))
+        if alignment is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return alignment
+
+    def set(self, node, element, alignment):
+        """
+        keep the alignment of the seed node, at its current version, with the record element.
+        """
+        if len(self._entries) >= self.max_entries:
+            self.evictions += len(self._entries)
+            self._entries.clear()
+        self._entries[node, node.version, element] = alignment
+
+    def clear(self):
+        """
+        remove all the alignments, the statistics are kept.
+        """
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import collections
+import operator
+
+from lxml import etree
+
+from .utils import simplify_xpath
+
+def _has_text(text):
+    # the whitespaces of normalize-space()
+    return text is not None and text.strip(' \t\r\n') != ''
+
+def rank_candidates(doc, root=None):
+    """
+    rank the data record candidates of the document in one walk of the tree.
+
+    The elements holding a non-empty text (the preceding sibling holds a tail text)
+    are grouped by their tag path, i.e. their xpath without indexes. The deepest
+    common ancestor of each group is a candidate, the candidates shared by more
+    groups come first.
+
+    Returns
+    -------
+    A list of ``(candidate, count)`` with the number of groups of each candidate,
+    by decreasing count.
+
+    It's the same ranking as matching ``//*/text()[normalize-space()]`` and comparing
+    the xpaths, but the common ancestors are found by element identity along
+    the walk, so the cost is linear in the number of nodes.
+
+    The candidates are looked for within ``root`` if given, the root of the document otherwise.
+
+    >>> from lxml import etree
+    >>> doc = etree.XML("<div><ul><li><a>1</a><b>x</b></li><li><a>2</a><b>y</b></li></ul><p>z</p></div>")
+    >>> [(e.tag, count) for e, count in rank_candidates(doc.getroottree())]
+    [('ul', 2), ('p', 1)]
+    """
+    if root is None:
+        root = doc.getroot()
+    # the tag path of an element, keyed by the tag path of its parent and its tag
+    paths = {}
+    # the groups by tag path: the ancestors of the first element and the depth of
+    # their deepest common ancestor
+    groups = {}
+
+    def tag_path(parent_path, node):
+        key = (parent_path, node.tag if isinstance(node.tag, basestring) else (node.tag, getattr(node, 'target', None)))
+        path = paths.get(key)
+        if path is None:
+            # the name of the node as in its xpath, e.g. comment()
+            name = simplify_xpath(doc.getpath(node)).rsplit('/', 1)[-1]
+            path = paths[key] = parent_path + '/' + name
+        return path
+
+    def visit(path):
+        group = groups.get(path[-1])
+        if group is None:
+            groups[path[-1]] = [ancestors[:], len(ancestors) - 1]
+            return
+        first, depth = group
+        while first[depth] is not ancestors[depth]:
+            depth -= 1
+        group[1] = depth
+
+    ancestors = []
+    parent = root.getparent()
+    tag_paths = [simplify_xpath(doc.getpath(parent)) if parent is not None else '']
+    for event, node in etree.iterwalk(root, events=('start', 'end', 'comment', 'pi')):
+        if event == 'end':
+            if node is not root and _has_text(node.tail):
+                visit(tag_paths)
+            ancestors.pop()
+            tag_paths.pop()
+            continue
+
+        ancestors.append(node)
+        tag_paths.append(tag_path(tag_paths[-1], node))
+        if event == 'start':
+            if _has_text(node.text):
+                visit(tag_paths)
+        else:
+            # comments and processing instructions only have a tail
+            if _has_text(node.tail):
+                visit(tag_paths)
+            ancestors.pop()
+            tag_paths.pop()
+
+    counter = collections.Counter()
+    candidates = {}
+    for first, depth in groups.itervalues():
+        xpath = doc.getpath(first[depth])
+        counter[xpath] += 1
+        candidates[xpath] = first[depth]
+
+    return [(candidates[k], v) for k, v in sorted(counter.items(), key=operator.itemgetter(1), reverse=True)]
+
+def find_candidates(doc, root=None):
+    """
+    rank the data record candidates of the document, see ``rank_candidates``.
+    """
+    return [candidate for candidate, count in rank_candidates(doc, root)]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+The clustering backends of ``MDR.hcluster``.
+
+A backend clusters the children of a candidate from their similarity matrix,
+it's a callable taking the matrix and the threshold and returning the list of
+cluster ids. scipy is only imported by the backends which need it.
+"""
+import numpy as np
+
+class LegacyLinkage(object):
+    """
+    Complete linkage of the rows of the similarity matrix.
+
+    scipy treats each row as an observation vector, so the distance of two children
+    is the euclidean distance of their similarities to all the children. It's the
+    original behavior of ``MDR.hcluster``, O(n^3) in the number of children.
+
+    >>> LegacyLinkage()(np.array([[1, 1, 0], [1, 1, 0], [0, 0, 1]], np.float), 0.9)
+    [1, 1, 2]
+    """
+
+    def __call__(self, m, threshold):
+        import scipy.cluster.hierarchy as sch
+        L = sch.linkage(m, method='complete')
+        return sch.fcluster(L, threshold, 'distance').tolist()
+
+class CondensedLinkage(object):
+    """
+    Complete linkage of the distances ``1 - similarity``.
+
+    The distances are passed to scipy as a condensed vector, so the similarities are
+    used directly: two children end up in the same cluster only if all the children
+    of the cluster are within ``threshold`` distance of each other.
+
+    >>> CondensedLinkage()(np.array([[1, 0.5, 0], [0.5, 1, 0.2], [0, 0.2, 1]]), 0.6)
+    [1, 1, 2]
+    """
+
+    def __call__(self, m, threshold):
+        import scipy.cluster.hierarchy as sch
+        rows, cols = np.triu_indices(len(m), 1)
+        distances = 1 - np.asarray(m, np.float)[rows, cols]
+        if not len(distances):
+            return [1] * len(m)
+        L = sch.linkage(np.clip(distances, 0, 1), method='complete')
+        return sch.fcluster(L, threshold, 'distance').tolist()
+
+class ThresholdGraph(object):
+    """
+    The connected components of the graph linking the children within ``threshold``
+    distance ``1 - similarity`` of each other, found with union-find.
+
+    It's single linkage cut at ``threshold``: no scipy and no linkage tree, which makes
+    it the fastest backend for small candidates. The cluster ids are numbered in order
+    of first appearance, starting from 1 as with scipy.
+
+    >>> ThresholdGraph()(np.array([[1, 0.5, 0], [0.5, 1, 0.2], [0, 0.2, 1]]), 0.6)
+    [1, 1, 2]
+    """
+
+    def __call__(self, m, threshold):
+        n = len(m)
+        parents = range(n)
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        rows, cols = np.nonzero(np.triu(1 - np.asarray(m, np.float) <= threshold, 1))
+        for i, j in zip(rows.tolist(), cols.tolist()):
+            a, b = find(i), find(j)
+            if a != b:
+                parents[max(a, b)] = min(a, b)
+
+        ids = {}
+        return [ids.setdefault(find(i), len(ids) + 1) for i in range(n)]
+
+BACKENDS = {
+    'legacy': LegacyLinkage,
+    'condensed': CondensedLinkage,
+    'graph': ThresholdGraph,
+}
+
+def get_backend(backend):
+    """
+    get the clustering backend by its name in ``BACKENDS``, a backend class is
+    instantiated and any other callable is returned as is.
+
+    >>> get_backend('graph')  # doctest: +ELLIPSIS
+    <mdr.cluster.ThresholdGraph object at ...>
+    >>> get_backend(CondensedLinkage)  # doctest: +ELLIPSIS
+    <mdr.cluster.CondensedLinkage object at ...>
+    """
+    if isinstance(backend, type):
+        backend = backend()
+    if callable(backend):
+        return backend
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError('unknown clustering backend: %r' % backend)
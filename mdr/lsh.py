@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+def _mix(x):
+    # the finalizer of splitmix64, numpy wraps the uint64 arithmetic
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xbf58476d1ce4e5b9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94d049bb133111eb)
+    x = x ^ (x >> np.uint64(31))
+    return x
+
+class MinHashLSH(object):
+    """
+    Group the similar subtrees with locality sensitive hashing.
+
+    Each subtree is sketched with the MinHash of the set of its tag paths, the
+    sketch is split in ``bands`` and a subtree sharing all the values of any band
+    with the representative of a bucket joins it. Two subtrees whose tag paths have a Jaccard
+    similarity ``s`` share a bucket with a probability of ``1 - (1 - s^r)^b``, where
+    ``r`` is the number of values per band.
+
+    Parameters
+    ----------
+    num_perm: int
+        the number of hash functions of the MinHash sketch.
+
+    bands: int
+        the number of bands, must divide ``num_perm``.
+
+    min_children: int
+        ``MDR`` only groups the children of candidates with at least this many children.
+
+    seed: int
+        the seed of the hash functions.
+
+    >>> from lxml import etree
+    >>> from ._tree import CompactTree
+    >>> t = CompactTree(etree.XML("<ul><li><a/><b/></li><p/><li><a/><b/></li><li><b/><a/></li></ul>"))
+    >>> MinHashLSH(num_perm=16, bands=8).buckets(t, t.child_nodes(0)).tolist()
+    [0, 1, 0, 0]
+    """
+
+    def __init__(self, num_perm=64, bands=16, min_children=500, seed=0):
+        if num_perm % bands:
+            raise ValueError('bands must divide num_perm')
+        self.num_perm = num_perm
+        self.bands = bands
+        self.min_children = min_children
+        self.seed = seed
+
+    def sketch(self, tree, nodes):
+        """
+        get the MinHash sketch of the subtree of each node in ``nodes``,
+        a matrix with one row per node.
+        """
+        rng = np.random.RandomState(self.seed)
+        salts = rng.randint(0, 2 ** 32, size=self.num_perm).astype(np.uint64) << np.uint64(32)
+        salts |= rng.randint(0, 2 ** 32, size=self.num_perm).astype(np.uint64)
+
+        sketches = np.zeros((len(nodes), self.num_perm), np.uint64)
+        if not len(nodes):
+            return sketches
+
+        # the subtree of a node is a contiguous range of nodes in preorder
+        starts = np.asarray(nodes)
+        stops = starts + tree.sizes[starts]
+        paths = tree.path_hashes()
+        for k, (start, stop) in enumerate(zip(starts, stops)):
+            sketches[k] = _mix(paths[start:stop, None] ^ salts[None, :]).min(axis=0)
+        return sketches
+
+    def buckets(self, tree, nodes):
+        """
+        get the bucket of the subtree of each node in ``nodes``, the buckets are numbered
+        in order of first appearance.
+
+        The first member of a bucket represents it, a subtree joins the bucket of the
+        first representative it shares a band with, or else starts a new one. The
+        buckets aren't merged across bands, so every member is a candidate pair of its
+        representative.
+        """
+        sketches = self.sketch(tree, nodes)
+        bands = [map(tuple, band.tolist()) for band in np.split(sketches, self.bands, axis=1)]
+        # the bucket of the representative with each value of each band
+        found = [{} for _ in bands]
+
+        buckets = np.zeros(len(nodes), np.int)
+        n_buckets = 0
+        for i in range(len(nodes)):
+            keys = [band[i] for band in bands]
+            for seen, key in zip(found, keys):
+                if key in seen:
+                    buckets[i] = seen[key]
+                    break
+            else:
+                buckets[i] = n_buckets
+                for seen, key in zip(found, keys):
+                    seen[key] = n_buckets
+                n_buckets += 1
+        return buckets
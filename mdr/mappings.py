@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+The mappings of the records aligned to a seed record.
+
+The nodes of a record are numbered in preorder over its trees, the mapping of a
+record is the pairs of aligned ``(seed node, record node)``. The pairs of all the
+records are kept in a few flat arrays, the elements are only looked up when a
+mapping is accessed.
+"""
+import itertools
+
+import numpy as np
+
+def iter_nodes(record):
+    """
+    iterate over the elements of the trees of a record in preorder.
+    """
+    return itertools.chain(*[tree.iter() for tree in record])
+
+class RecordMappings(object):
+    """
+    The mappings from the seed elements to the elements of each aligned record.
+
+    It behaves like an ordered dict from the record to the ``RecordMapping`` of
+    its elements, in order of alignment.
+
+    Parameters
+    ----------
+    seed: ``Record``
+        the seed record, i.e. the keys of the mappings.
+
+    records: list
+        the aligned records.
+
+    offsets: array
+        the pairs of ``records[k]`` are the pairs ``offsets[k]`` to ``offsets[k + 1] - 1``.
+
+    seed_nodes, record_nodes: array
+        the seed node and the record node of each pair, the pairs of each record are
+        sorted by seed node.
+
+    >>> from lxml.html import fragment_fromstring
+    >>> from .mdr import Record
+    >>> seed, record = Record(fragment_fromstring('<p><a/><b/></p>')), Record(fragment_fromstring('<p><b/></p>'))
+    >>> mappings = RecordMappings(seed, [record], [0, 2], [0, 2], [0, 1])
+    >>> [(k.tag, v.tag) for k, v in mappings[record].iteritems()]
+    [('p', 'p'), ('b', 'b')]
+    >>> seed[0][0] in mappings[record]
+    False
+    """
+
+    def __init__(self, seed, records, offsets, seed_nodes, record_nodes):
+        self.seed = seed
+        self.records = list(records)
+        self.offsets = np.asarray(offsets, np.intc)
+        self.seed_nodes = np.asarray(seed_nodes, np.intc)
+        self.record_nodes = np.asarray(record_nodes, np.intc)
+        self._positions = None
+        self._seed_elements = None
+        self._seed_index = None
+
+    @property
+    def seed_elements(self):
+        """
+        the elements of the seed in preorder.
+        """
+        if self._seed_elements is None:
+            self._seed_elements = list(iter_nodes(self.seed))
+        return self._seed_elements
+
+    def seed_index(self, element):
+        """
+        get the preorder index of a seed element, None if it's not in the seed.
+        """
+        if self._seed_index is None:
+            self._seed_index = dict((e, i) for i, e in enumerate(self.seed_elements))
+        return self._seed_index.get(element)
+
+    def _position(self, record):
+        if self._positions is None:
+            self._positions = dict((r, k) for k, r in enumerate(self.records))
+        return self._positions[record]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __contains__(self, record):
+        try:
+            self._position(record)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, record):
+        k = self._position(record)
+        start, stop = self.offsets[k], self.offsets[k + 1]
+        return RecordMapping(self, record, self.seed_nodes[start:stop], self.record_nodes[start:stop])
+
+    def get(self, record, default=None):
+        return self[record] if record in self else default
+
+    def keys(self):
+        return list(self.records)
+
+    def iterkeys(self):
+        return iter(self.records)
+
+    def itervalues(self):
+        for record in self.records:
+            yield self[record]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        for record in self.records:
+            yield record, self[record]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def pop(self, record, *default):
+        """
+        remove the mapping of ``record`` and return it.
+        """
+        if record not in self:
+            if default:
+                return default[0]
+            raise KeyError(record)
+        mapping = self[record]
+        k = self._position(record)
+        start, stop = self.offsets[k], self.offsets[k + 1]
+        self.seed_nodes = np.delete(self.seed_nodes, np.s_[start:stop])
+        self.record_nodes = np.delete(self.record_nodes, np.s_[start:stop])
+        self.offsets = np.delete(self.offsets, k + 1)
+        self.offsets[k + 1:] -= stop - start
+        del self.records[k]
+        self._positions = None
+        return mapping
+
+class RecordMapping(object):
+    """
+    A read-only view of the mapping from the seed elements to the elements of a record,
+    behaves like a dict.
+    """
+    __slots__ = ('mappings', 'record', 'seed_nodes', 'record_nodes', '_record_elements')
+
+    def __init__(self, mappings, record, seed_nodes, record_nodes):
+        self.mappings = mappings
+        self.record = record
+        self.seed_nodes = seed_nodes
+        self.record_nodes = record_nodes
+        self._record_elements = None
+
+    @property
+    def record_elements(self):
+        """
+        the elements of the record in preorder.
+        """
+        if self._record_elements is None:
+            self._record_elements = list(iter_nodes(self.record))
+        return self._record_elements
+
+    def _find(self, element):
+        # the pair of the seed element, -1 if it's not aligned
+        i = self.mappings.seed_index(element)
+        if i is None:
+            return -1
+        k = np.searchsorted(self.seed_nodes, i)
+        if k < len(self.seed_nodes) and self.seed_nodes[k] == i:
+            return k
+        return -1
+
+    def __len__(self):
+        return len(self.seed_nodes)
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __contains__(self, element):
+        return self._find(element) >= 0
+
+    def __getitem__(self, element):
+        k = self._find(element)
+        if k < 0:
+            raise KeyError(element)
+        return self.record_elements[self.record_nodes[k]]
+
+    def get(self, element, default=None):
+        k = self._find(element)
+        return self.record_elements[self.record_nodes[k]] if k >= 0 else default
+
+    def iterkeys(self):
+        seed_elements = self.mappings.seed_elements
+        return (seed_elements[i] for i in self.seed_nodes.tolist())
+
+    def itervalues(self):
+        record_elements = self.record_elements
+        return (record_elements[i] for i in self.record_nodes.tolist())
+
+    def iteritems(self):
+        return itertools.izip(self.iterkeys(), self.itervalues())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
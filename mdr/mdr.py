@@ -2,25 +2,64 @@
 import copy
 import collections
 import itertools
-import operator
+import json
+import pickle
+import time
 
-from cStringIO import StringIO
+from multiprocessing import Pool, TimeoutError, cpu_count
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty
 from lxml import etree
+import lxml.html
 
 import numpy as np
-import scipy.cluster.hierarchy as sch
 
-from ._tree import tree_size
-from .tree import PartialTreeAligner, clustered_tree_match
-from .utils import split_sequence, common_prefix, simplify_xpath
+from ._tree import (tree_size, CompactTree, SimilarityMemo, compact_clustered_tree_match,
+                    clustered_tree_match_pairs, clustered_tree_match_bounds,
+                    record_similarity, record_similarities)
+from .tree import PartialTreeAligner, SeedIndex, SeedNode
+from .cache import TreeSimilarityCache, AlignmentCache
+from .candidates import find_candidates, rank_candidates
+from .cluster import get_backend, CondensedLinkage, ThresholdGraph
+from .mappings import RecordMappings, iter_nodes
+from .scheduling import get_scheduler
+from .utils import split_sequence
+
+# the attributes used by the tree matchers, kept by ``Record.to_dict``
+MATCHED_ATTRIBUTES = ('class', 'itemprop')
 
 class Record(object):
     """A class represent a data record.
 
     Usually it just a list of DOM elements.
+
+    A record can be serialized with its tag structure, the attributes used by the
+    matchers and the names of its fields (e.g. to save the seed record learned from
+    a page and extract the other pages of the site with ``MDR.extract(record=...)``):
+
+    >>> from lxml.html import fragment_fromstring
+    >>> t = fragment_fromstring('<li class="item"><a href="#">x</a><span itemprop="price">1</span></li>')
+    >>> s = Record(t).dumps(fields={t[1]: 'price'})
+    >>> s
+    '{"trees":[["li",{"class":"item"},[["a",{},[]],["span",{"itemprop":"price"},[],"price"]]]],"version":1}'
+    >>> record = Record.loads(s)
+    >>> [e.tag for e in record[0].iter()], [(e.tag, str(name)) for e, name in record.fields.items()]
+    (['li', 'a', 'span'], [('span', 'price')])
+
+    Only the tag structure is kept by ``to_dict``. Pickling a record keeps its trees
+    whole, with their text and all their attributes, and its fields, but not the rest
+    of the document. A copy shares the trees of the record:
+
+    >>> copied = pickle.loads(pickle.dumps(record))
+    >>> etree.tostring(copied[0]) == etree.tostring(record[0]), copied.fields.values() == record.fields.values()
+    (True, True)
+    >>> copy.copy(record)[0] is record[0]
+    True
     """
     def __init__(self, *trees):
         self.trees = trees
+        # the names of the fields, by element of the trees
+        self.fields = {}
 
     def __len__(self):
         return len(self.trees)
@@ -37,6 +76,131 @@ class Record(object):
     def size(self):
         return sum(tree_size(t) for t in self.trees)
 
+    def to_dict(self, fields=None):
+        """
+        serialize the trees of the record to a JSON-compatible dict.
+
+        Each node is a list ``[tag, attributes, children]``, followed by the name of
+        the field if the node is in ``fields`` (default to the ``fields`` of this record),
+        a dict from the elements of the trees to the field names.
+        """
+        if fields is None:
+            fields = self.fields
+
+        def encode(e):
+            if isinstance(e.tag, basestring):
+                tag = e.tag
+                attrib = dict((k, e.get(k)) for k in MATCHED_ATTRIBUTES if e.get(k) is not None)
+            else:
+                tag = '#' + e.tag.__name__
+                attrib = {'name': e.name} if tag == '#Entity' else {'target': e.target} if tag == '#ProcessingInstruction' else {}
+            node = [tag, attrib, [encode(child) for child in e]]
+            if e in fields:
+                node.append(fields[e])
+            return node
+
+        return {'version': 1, 'trees': [encode(t) for t in self.trees]}
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        rebuild a record serialized by ``to_dict``, its trees are the children of a new element.
+        """
+        fields = {}
+        root = etree.Element('record')
+
+        def decode(node, parent):
+            tag, attrib, children = node[:3]
+            if tag == '#Comment':
+                e = etree.Comment()
+            elif tag == '#ProcessingInstruction':
+                e = etree.ProcessingInstruction(attrib.get('target', 'pi'))
+            elif tag == '#Entity':
+                e = etree.Entity(attrib.get('name', 'entity'))
+            elif tag.startswith('#'):
+                raise ValueError('unknown node %r' % tag)
+            else:
+                e = etree.Element(tag, attrib)
+            parent.append(e)
+            for child in children:
+                decode(child, e)
+            if len(node) > 3:
+                fields[e] = node[3]
+            return e
+
+        record = cls(*[decode(node, root) for node in d['trees']])
+        record.fields = fields
+        return record
+
+    def dumps(self, fields=None):
+        """
+        serialize the record to a JSON string, see ``to_dict``.
+        """
+        return json.dumps(self.to_dict(fields), separators=(',', ':'), sort_keys=True)
+
+    @classmethod
+    def loads(cls, s):
+        """
+        rebuild a record from the JSON string of ``dumps``.
+        """
+        return cls.from_dict(json.loads(s))
+
+    def __reduce__(self):
+        # the fields by the position of their element in the trees
+        positions = dict((e, (i, k)) for i, tree in enumerate(self.trees) for k, e in enumerate(tree.iter()))
+        fields = [positions[e] + (name,) for e, name in self.fields.iteritems() if e in positions]
+        trees = [(_encode_node(tree), isinstance(tree, lxml.html.HtmlMixin)) for tree in self.trees]
+        return _record_from_trees, (trees, fields)
+
+    def __copy__(self):
+        record = Record(*self.trees)
+        record.fields = dict(self.fields)
+        return record
+
+    def __deepcopy__(self, memo):
+        record = Record(*copy.deepcopy(self.trees, memo))
+        for e, copied in zip(itertools.chain(*[t.iter() for t in self.trees]),
+                             itertools.chain(*[t.iter() for t in record.trees])):
+            if e in self.fields:
+                record.fields[copied] = self.fields[e]
+        return record
+
+def _encode_node(e):
+    # the structure of a node for pickle, any markup is kept, well-formed or not
+    if isinstance(e.tag, basestring):
+        tag, attrib = e.tag, e.items()
+    else:
+        tag = '#' + e.tag.__name__
+        attrib = e.name if tag == '#Entity' else e.target if tag == '#ProcessingInstruction' else None
+    return tag, attrib, e.text, e.tail, [_encode_node(child) for child in e]
+
+def _decode_node(node, makeelement):
+    tag, attrib, text, tail, children = node
+    if tag == '#Comment':
+        e = etree.Comment(text)
+    elif tag == '#ProcessingInstruction':
+        e = etree.ProcessingInstruction(attrib, text)
+    elif tag == '#Entity':
+        e = etree.Entity(attrib)
+    else:
+        e = makeelement(tag)
+        for name, value in attrib:
+            e.set(name, value)
+        e.text = text
+    e.tail = tail
+    for child in children:
+        e.append(_decode_node(child, makeelement))
+    return e
+
+def _record_from_trees(trees, fields):
+    # rebuild a pickled record, each tree in its own document
+    rebuilt = [_decode_node(node, lxml.html.html_parser.makeelement if html else etree.Element)
+               for node, html in trees]
+    record = Record(*rebuilt)
+    elements = [list(tree.iter()) for tree in rebuilt]
+    record.fields = dict((elements[i][k], name) for i, k, name in fields)
+    return record
+
 class MDR(object):
     """
     Mining Data Record base on clustering and tree similarity.
@@ -49,6 +213,69 @@ class MDR(object):
     threshold: float
         the similarity threshold to cluster the DOM trees.
 
+    n_threads: int
+        the number of threads used to calculate the similarity matrix, their pool is
+        terminated by ``close`` or at the end of a ``with`` block.
+
+    memo_size: int
+        the capacity of the ``SimilarityMemo`` shared by the tree matchers and aligners,
+        0 to disable it.
+
+    similarity_cache: optional
+        a persistent cache of the similarities, e.g. ``SQLiteSimilarityCache``, looked up
+        before computing the similarity matrix.
+
+    cache_size: int
+        the maximum number of element pairs kept in ``tree_sim_cache``.
+
+    prune: bool or 'bound'
+        skip the tree match of the pairs whose upper bound of similarity shows they
+        can't be clustered together within ``threshold``, their similarity is set to 0
+        (or to the bound itself with 'bound'). The clusters are the same only with the
+        'condensed' and 'graph' clustering, which never link such a pair, so it
+        requires one of them: 'legacy' compares whole rows of the matrix.
+
+    lsh: optional
+        a ``MinHashLSH`` grouping the children of the candidates with many children
+        in buckets, only the pairs of bucket representatives and the pairs of a
+        representative and its members are matched. Two members of a bucket take the
+        lower similarity of theirs to the representative, the others take the
+        similarity of their representatives.
+
+    sample_size: int, optional
+        cluster only a stratified sample of this many children of the candidates with
+        more children, every other child joins the cluster of its most similar medoid.
+        At least 2, the linkage needs a pair.
+
+    random_state: int
+        the seed of the sample, so the clusters are reproducible.
+
+    clustering: str or callable
+        the clustering backend of ``hcluster``, one of 'legacy' (complete linkage of
+        the matrix rows, the default), 'condensed' (complete linkage of the distances
+        ``1 - similarity``) and 'graph' (union-find of the pairs within ``threshold``
+        distance), a backend class of ``mdr.cluster`` or a callable taking the similarity
+        matrix and the threshold.
+
+    template_cache: optional
+        a ``TemplateCache`` of the listing location of each page template, used by ``extract_page``.
+
+    sample_pairs: int, optional
+        estimate the score of each record division from a sample of this many pairs
+        of records, see ``RecordFinder``. The divisions are scored exactly by default.
+
+    native_align: bool
+        align the records with the native ``CompactTreeAligner``, which only keeps the
+        scores and rebuilds the winning alignment, the mappings are the same.
+
+    scheduler: str or scheduler
+        the order in which ``RecordAligner`` aligns the records, 'fifo' (the default) or
+        'benefit' (requeues the records with the most unaligned nodes first), see ``mdr.scheduling``.
+
+    max_rounds: int, optional
+        the maximum number of times ``RecordAligner`` aligns a record, no limit by default
+        since the records are only aligned again when the seed grows.
+
     References
     ----------
     .. [1] Using clustering and edit distance techniques for automatic web data extraction
@@ -60,52 +287,174 @@ class MDR(object):
     .. [3] Automatic Wrapper Adaptation by Tree Edit Distance Matching
     <http://arxiv.org/pdf/1103.1252.pdf>
     """
-    def __init__(self, threshold=0.9):
+    def __init__(self, threshold=0.9, n_threads=1, memo_size=65536, similarity_cache=None,
+                 cache_size=1000000, prune=False, lsh=None, sample_size=None, random_state=0,
+                 clustering='legacy', template_cache=None, sample_pairs=None, native_align=False,
+                 scheduler='fifo', max_rounds=None):
+        # the arguments, to build the same ``MDR`` in the worker processes of ``extract_many``
+        self._config = locals().copy()
+        del self._config['self']
         self.threshold = threshold
-        self.tree_sim_cache = {}
-        self.ra = RecordAligner()
+        self.n_threads = n_threads
+        self.prune = prune
+        self.lsh = lsh
+        self.sample_size = sample_size
+        self.random_state = random_state
+        self.clustering = get_backend(clustering)
+        if sample_size is not None and sample_size < 2:
+            raise ValueError('sample_size must be at least 2')
+        if prune and not isinstance(self.clustering, (CondensedLinkage, ThresholdGraph)):
+            raise ValueError("prune requires the 'condensed' or 'graph' clustering")
+        self.template_cache = template_cache
+        self.sample_pairs = sample_pairs
+        self.memo = SimilarityMemo(memo_size) if memo_size else None
+        self.similarity_cache = similarity_cache
+        self.tree_sim_cache = TreeSimilarityCache(cache_size)
+        self.ra = RecordAligner(self.memo, native_align, scheduler, max_rounds)
+        self._pool = None
+        self._parsers = {}
+        # the last seed record of ``seed_clusters`` with its encoded trees
+        self._seed = None
 
     def list_candidates(self, html, encoding='utf8'):
         """
         list all the data record candidates.
 
+        Parameters
+        ----------
+        html: str, unicode, bytes-like, lxml document or element
+            the page to parse, a bytes-like object (``bytearray``, ``memoryview``, ``mmap``)
+            is parsed chunk by chunk without copying it. An lxml document or element is
+            used as is, the candidates of an element are its descendants.
+
+        encoding: str
+            the encoding of the page, the parser of each encoding is reused across calls.
+
         Returns
         -------
         A sorted list of elements with descreasing order of odds of being an candidate.
         """
-        if isinstance(html, unicode):
-            html = html.encode(encoding)
+        doc, root = self.parse(html, encoding)
+        if root is None:
+            return [], doc
+        return find_candidates(doc, root), doc
+
+    def iter_candidates(self, html, encoding='utf8'):
+        """
+        iterate over the data record candidates in rank order, with their score: the
+        share of the groups of text elements (by tag path) the candidate is the
+        deepest common ancestor of.
+
+        Returns
+        -------
+        A generator of ``(candidate, score)``.
+        """
+        doc, root = self.parse(html, encoding)
+        if root is None:
+            return
+        ranked = rank_candidates(doc, root)
+        total = float(sum(count for candidate, count in ranked))
+        for candidate, count in ranked:
+            yield candidate, count / total
+
+    def iter_extract(self, html, encoding='utf8', min_confidence=0.9, min_coverage=0.3, max_candidates=5):
+        """
+        extract the data records of the candidates in rank order, until the records
+        of a candidate pass both thresholds. The candidates with less than 2 children
+        are skipped.
+
+        Parameters
+        ----------
+        html: str, unicode, bytes-like, lxml document or element
+            the page, see ``list_candidates``.
+
+        min_confidence: float
+            the minimum average share of the nodes of a record aligned with the seed, None to ignore it.
+
+        min_coverage: float
+            the minimum share of the nodes of the page within the records, None to ignore it.
+
+        max_candidates: int
+            the maximum number of candidates extracted.
 
-        parser = etree.HTMLParser(encoding=encoding)
-        doc = etree.parse(StringIO(html), parser)
+        Returns
+        -------
+        A generator of dict for each candidate extracted, with keys:
+
+        candidate: the candidate element
+        score: the score of the candidate, see ``iter_candidates``
+        seed: the seed ``Record``, None if no records are found
+        mappings: the mappings of the records, see ``extract``
+        confidence, coverage: see above, 0 if no records are found
+        passed: if the records pass the thresholds, the last candidate then
+        """
+        candidates = self.iter_candidates(html, encoding)
+        # the candidates with less than 2 children can't hold records
+        candidates = ((candidate, score) for candidate, score in candidates if len(candidate) > 1)
+        for candidate, score in itertools.islice(candidates, max_candidates):
+            seed_record, mappings = self.extract(candidate)
+            confidence, coverage = self._record_quality(candidate, seed_record, mappings)
+            passed = (seed_record is not None and
+                      (min_confidence is None or confidence >= min_confidence) and
+                      (min_coverage is None or coverage >= min_coverage))
+            yield {'candidate': candidate, 'score': score, 'seed': seed_record, 'mappings': mappings,
+                   'confidence': confidence, 'coverage': coverage, 'passed': passed}
+            if passed:
+                return
+
+    def _record_quality(self, candidate, seed_record, mappings):
+        """the confidence and coverage of the extracted records, see ``iter_extract``.
+        """
+        if seed_record is None or not mappings:
+            return 0.0, 0.0
+        sizes = [record.size() for record in mappings]
+        confidence = sum(min(len(mapping), size) / float(size) for mapping, size in zip(mappings.itervalues(), sizes)) / len(sizes)
+        coverage = sum(sizes) / float(tree_size(candidate.getroottree().getroot()))
+        return confidence, coverage
+
+    def parse(self, html, encoding='utf8'):
+        """
+        parse the given page, see ``list_candidates``.
 
-        d = {}
-        # find all the non-empty text nodes
-        for e in doc.xpath('//*/text()[normalize-space()]'):
-            p = e.getparent()
-            xpath = doc.getpath(p)
-            d.setdefault(simplify_xpath(xpath), []).append(xpath)
+        Returns
+        -------
+        The lxml document and its root element (None if the page is empty).
+        """
+        if isinstance(html, etree._ElementTree):
+            return html, html.getroot()
+        if isinstance(html, etree._Element):
+            return html.getroottree(), html
 
-        counter = collections.Counter()
-        for key, elements in d.iteritems():
-            deepest_common_ancestor = "/".join(common_prefix(*[xpath.split('/') for xpath in elements]))
-            counter[deepest_common_ancestor] += 1
+        parser = self._parsers.get(encoding)
+        if parser is None:
+            parser = self._parsers[encoding] = etree.HTMLParser(encoding=encoding)
 
-        return [doc.xpath(k)[0] for k,v in sorted(counter.items(), key=operator.itemgetter(1), reverse=True)], doc
+        if isinstance(html, unicode):
+            html = html.encode(encoding)
+        if isinstance(html, str):
+            root = etree.fromstring(html, parser)
+            return (etree.ElementTree() if root is None else root.getroottree()), root
 
-    def extract(self, element, record=None):
+        doc = etree.parse(_BufferReader(html), parser)
+        return doc, doc.getroot()
+
+    def extract(self, element, record=None, encoding='utf8'):
         """
         extract the data record from data record candidate.
 
         Parameters
         ----------
         element: lxml HTML element
-            the HTML element of the candidate
+            the HTML element of the candidate, or a page or an lxml document as in
+            ``list_candidates`` whose best candidate is used.
 
         record: optional
             The seed record learned before.
             used to speed up the extraction without finding the seed elements.
 
+        encoding: str
+            the encoding of the page.
+
         See Also
         --------
         ``RecordAligner``
@@ -115,26 +464,31 @@ class MDR(object):
         seed_record: ``Record``
              the seed record to match against other record trees.
 
-        mappings: dict
-             a dict mapping from aligned record to a nested dict mapping from seed element to element.
+        mappings: ``RecordMappings``
+             an ordered dict-like mapping from aligned record to a dict-like mapping from
+             seed element to element, the pairs of elements are kept as arrays of node indexes.
 
         """
+        if not isinstance(element, etree._Element):
+            candidates, doc = self.list_candidates(element, encoding)
+            if not candidates:
+                return None, {}
+            element = candidates[0]
+
         if record:
-            n = len(element)
-            clusters = []
-            # use index as cluster id
-            for i in range(n):
-                sims = [[clustered_tree_match(element[i], record[j]), j] for j in range(len(record))]
-                clusters.append(max(sims, key=operator.itemgetter(0))[1])
+            clusters = self.seed_clusters(element, record)
             rf = RecordFinder()
             records = rf.find_division(element.getchildren(), clusters, 0)
 
         else:
-            m = self.calculate_similarity_matrix(element)
-            clusters = self.hcluster(m)
-            assert len(clusters) == len(m)
+            if self.sample_size and len(element) > self.sample_size:
+                clusters = self.sample_clusters(element)
+            else:
+                m = self.calculate_similarity_matrix(element)
+                clusters = self.hcluster(m)
+                assert len(clusters) == len(m)
 
-            rf = RecordFinder(self.tree_sim_cache)
+            rf = RecordFinder(self.tree_sim_cache, self.sample_pairs, self.random_state)
             records = rf.find_best_division(element.getchildren(), clusters)
 
         if records:
@@ -146,38 +500,382 @@ class MDR(object):
         return None, {}
 
 
-    def calculate_similarity_matrix(self, element):
+    def seed_clusters(self, element, record):
+        """assign each child of the given element to the most similar tree of the
+        seed record, the index of the tree is the cluster id (0 if no tree matches).
+
+        The seed trees are indexed by root tag, the children with another tag can't
+        match them. The children with the same structural fingerprint have the same
+        similarities, so they are only matched once.
+        """
+        if self._seed is None or self._seed[0] is not record:
+            seed_trees = [CompactTree(t) for t in record]
+            by_tag = {}
+            for j, seed_tree in enumerate(seed_trees):
+                by_tag.setdefault(seed_tree.tags[0], []).append(j)
+            self._seed = record, seed_trees, by_tag
+        _, seed_trees, by_tag = self._seed
+
+        tree = CompactTree(element)
+        nodes = tree.child_nodes(0)
+        if not len(nodes):
+            return []
+
+        fingerprints, first, inverse = np.unique(tree.hashes[nodes], return_index=True, return_inverse=True)
+        sims = np.zeros((len(fingerprints), len(seed_trees)), np.float)
+        for k, i in enumerate(nodes[first]):
+            for j in by_tag.get(tree.tags[i], ()):
+                sims[k, j] = compact_clustered_tree_match(tree, i, seed_trees[j], 0, memo=self.memo)
+
+        # the first most similar tree as ties
+        return sims.argmax(axis=1)[inverse].tolist()
+
+    def extract_page(self, html, encoding='utf8', min_records=2):
+        """
+        detect the best candidate of the page and extract its data records.
+
+        With a ``template_cache``, the candidate and the seed record of the template
+        of the page are tried first, the page is fully detected only if they are not
+        cached or give less than ``min_records`` records.
+
+        Returns
+        -------
+        candidate: the candidate element, None if the page has no candidates.
+
+        seed_record, mappings: see ``extract``, the seed record of the cache is
+        not in the mappings.
+        """
+        doc, root = self.parse(html, encoding)
+        if root is None:
+            return None, None, {}
+
+        if self.template_cache is not None:
+            key = self.template_cache.fingerprint(doc)
+            entry = self.template_cache.get(key)
+            if entry is not None:
+                xpath, record = entry
+                candidates = doc.xpath(xpath)
+                if candidates and len(candidates[0]) > 1:
+                    seed_record, mappings = self.extract(candidates[0], record)
+                    if len(mappings) >= min_records:
+                        return candidates[0], seed_record, mappings
+                self.template_cache.invalidate(key)
+
+        candidates = find_candidates(doc, root)
+        if not candidates:
+            return None, None, {}
+        seed_record, mappings = self.extract(candidates[0])
+
+        if self.template_cache is not None and seed_record is not None and len(mappings) >= min_records:
+            # the cached seed doesn't keep this document alive
+            self.template_cache.set(key, doc.getpath(candidates[0]), Record.from_dict(seed_record.to_dict()))
+        return candidates[0], seed_record, mappings
+
+    def extract_many(self, pages, processes=None, chunksize=8, max_pending=None, ordered=True, timeout=None):
+        """
+        detect and extract the data records of many pages with a pool of processes.
+
+        Each worker process parses the pages itself and keeps one ``MDR`` across
+        all the pages it gets, the results only contain plain strings so they can
+        be sent back from the workers.
+
+        Parameters
+        ----------
+        pages: iterable
+            an iterable of ``(html, encoding)`` pairs, consumed lazily.
+
+        processes: int, optional
+            the number of worker processes, default to the number of CPUs.
+
+        chunksize: int
+            the number of pages sent to a worker at once.
+
+        max_pending: int, optional
+            the maximum number of chunks in flight, default to twice the number of
+            processes. No more pages are read from ``pages`` until a chunk is done.
+
+        ordered: bool
+            yield the results in the input order, otherwise as they complete.
+
+        timeout: float, optional
+            the maximum number of seconds to wait for a chunk, then a ``multiprocessing.TimeoutError``
+            is raised. No limit by default, but a worker process that dies fails with a ``RuntimeError``
+            rather than blocking.
+
+        Returns
+        -------
+        A generator of dict for each page, with keys:
+
+        index: the position of the page in ``pages``
+        candidate: the xpath of the candidate element
+        seed: the xpaths of the seed record trees
+        fields: the index of the seed record tree and the xpath within that tree of each seed node
+        records: a list of dict with ``xpaths`` of the record trees and
+            the ``texts`` of the element aligned to each field (None if not aligned)
+        error: the error message if the page failed, None otherwise
+        """
+        processes = processes or cpu_count()
+        max_pending = max_pending or 2 * processes
+        pool = Pool(processes, _init_worker, (self._config,))
+        # the pool replaces a dead worker but its chunk is lost
+        workers = list(pool._pool)
+        done = Queue()
+        pending = collections.deque()
+
+        try:
+            chunks = _chunked(enumerate(pages), chunksize)
+            for chunk in itertools.chain(chunks, [None]):
+                if chunk is not None:
+                    callback = None if ordered else done.put
+                    pending.append(pool.apply_async(_extract_pages_or_error, (chunk,), callback=callback))
+                    if len(pending) < max_pending:
+                        continue
+
+                while pending and (len(pending) >= max_pending or chunk is None):
+                    if ordered:
+                        results, error = _wait(pending.popleft().get, workers, timeout)
+                    else:
+                        results, error = _wait(lambda t: done.get(timeout=t), workers, timeout)
+                        pending.pop()
+                    if error is not None:
+                        raise error
+                    for result in results:
+                        yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def calculate_similarity_matrix(self, element, report=False):
         """calculate the similarity matrix for each child of the given element
+
+        if ``report``, also return a dict with the number of ``pairs`` in the
+        matrix, the number of pairs ``pruned`` by their upper bound, the number
+        of pairs ``approximated`` by their bucket representatives and the number of
+        pairs ``matched`` exactly.
+        """
+        # encode the candidate once, the children are matched by their node
+        tree = CompactTree(element)
+        m, stats = self._similarity_matrix(tree, tree.child_nodes(0))
+
+        self.tree_sim_cache.bind(element)
+        self.tree_sim_cache.add_matrix(element.getchildren(), m)
+
+        if report:
+            return m, stats
+        return m
+
+    def sample_clusters(self, element):
+        """cluster a stratified sample of ``sample_size`` children of the given element,
+        then assign each other child to the cluster of its most similar medoid.
+
+        The ``tree_sim_cache`` gets the similarity matrix of the sample, the other
+        children share the similarities of their medoid.
+
+        Returns
+        -------
+        A list of the cluster id for each child.
         """
         n = len(element)
+        tree = CompactTree(element)
+        nodes = tree.child_nodes(0)
+
+        # one child at random in each of the sample_size strata of the children
+        rng = np.random.RandomState(self.random_state)
+        strata = np.linspace(0, n, self.sample_size + 1).astype(np.int)
+        sample = strata[:-1] + (rng.random_sample(self.sample_size) * np.diff(strata)).astype(np.int)
+
+        m, _ = self._similarity_matrix(tree, nodes[sample])
+        sample_clusters = np.array(self.hcluster(m))
+
+        # the medoid of a cluster is the child with the highest similarity to the others
+        medoids = []
+        for c in np.unique(sample_clusters):
+            members = np.flatnonzero(sample_clusters == c)
+            medoids.append(members[m[np.ix_(members, members)].sum(axis=1).argmax()])
+        medoids = np.array(medoids)
+
+        others = np.setdiff1d(np.arange(n), sample)
+        first = np.repeat(nodes[others], len(medoids)).astype(np.intc)
+        second = np.tile(nodes[sample[medoids]], len(others)).astype(np.intc)
+        values = self._similarities(tree, first, second).reshape(len(others), len(medoids))
+
+        # the row of each child in the sample matrix
+        rows = np.zeros(n, np.int)
+        rows[sample] = np.arange(len(sample))
+        rows[others] = medoids[values.argmax(axis=1)]
+
+        self.tree_sim_cache.bind(element)
+        self.tree_sim_cache.add_matrix(element.getchildren(), m, rows)
+
+        return sample_clusters[rows].tolist()
+
+    def _similarity_matrix(self, tree, nodes):
+        """the similarity matrix of the given nodes of ``tree``, and the report of
+        ``calculate_similarity_matrix``.
+        """
+        n = len(nodes)
+
+        rows, cols = np.triu_indices(n)
+        rows = rows.astype(np.intc)
+        cols = cols.astype(np.intc)
+        values = np.zeros(len(rows), np.float)
+        approximated = np.zeros(len(rows), np.bool)
+        pruned = np.zeros(len(rows), np.bool)
+
+        if self.lsh is not None and n >= self.lsh.min_children:
+            buckets = self.lsh.buckets(tree, nodes)
+            # the first child of each bucket represents it
+            _, representatives = np.unique(buckets, return_index=True)
+            is_representative = np.zeros(n, np.bool)
+            is_representative[representatives] = True
+            approximated = ~((rows == cols) | (is_representative[rows] & is_representative[cols]) |
+                             ((buckets[rows] == buckets[cols]) & is_representative[rows]))
+
+        if self.prune:
+            bounds = np.zeros(len(rows), np.float)
+            clustered_tree_match_bounds(tree, nodes[rows], nodes[cols], bounds)
+            # pairs which can't be within the threshold distance of each other
+            pruned = (bounds < 1 - self.threshold) & ~approximated
+            if self.prune == 'bound':
+                values[pruned] = bounds[pruned]
+
+        exact = np.flatnonzero(~(pruned | approximated))
+
+        values[exact] = self._similarities(tree, nodes[rows[exact]], nodes[cols[exact]])
 
         m = np.zeros((n, n), np.float)
-        for i in range(n):
-            for j in range(n):
-                if j >= i:
-                    m[i, j] = clustered_tree_match(element[i], element[j])
-                    self.tree_sim_cache[(element[i], element[j])] = m[i, j]
-                    self.tree_sim_cache[(element[j], element[i])] = m[i, j]
-                    m[j, i] = m[i, j]
-        return m
+        m[rows, cols] = values
+        m[cols, rows] = values
+
+        if approximated.any():
+            r, c = rows[approximated], cols[approximated]
+            first, second = representatives[buckets[r]], representatives[buckets[c]]
+            # the members of a bucket are only matched to its representative
+            values = np.where(first == second, np.minimum(m[first, r], m[first, c]), m[first, second])
+            m[r, c] = values
+            m[c, r] = values
+
+        return m, {'pairs': len(rows), 'pruned': int(pruned.sum()),
+                   'approximated': int(approximated.sum()), 'matched': len(exact)}
+
+    def _similarities(self, tree, first, second):
+        """clustered tree match of the node pairs of ``tree``, through the similarity
+        cache if any.
+        """
+        if self.similarity_cache is not None:
+            return self._cached_similarities(tree, first, second)
+        return self._match_pairs(tree, first, second)
+
+    def _match_pairs(self, tree, first, second):
+        """clustered tree match of the node pairs of ``tree``, with the thread pool
+        if ``n_threads`` is more than 1.
+        """
+        values = np.zeros(len(first), np.float)
+        if self.n_threads > 1 and len(first) > 1:
+            bounds = np.linspace(0, len(first), self.n_threads + 1).astype(int)
+            chunks = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+            self._get_pool().map(lambda c: clustered_tree_match_pairs(tree, first[c], second[c], values[c], self.memo),
+                                 chunks)
+        else:
+            clustered_tree_match_pairs(tree, first, second, values, self.memo)
+        return values
+
+    def _cached_similarities(self, tree, first, second):
+        """look up the similarities of the node pairs in the similarity cache,
+        only the pairs of fingerprints not in the cache are computed (once for each pair).
+        """
+        keys = zip(tree.hashes[first].tolist(), tree.hashes[second].tolist())
+
+        pairs = {}
+        for k, key in enumerate(keys):
+            pairs.setdefault(key, k)
+
+        similarities = self.similarity_cache.get_many(pairs.keys())
+        missing = [key for key in pairs if key not in similarities]
+        indexes = np.array([pairs[key] for key in missing], np.int)
+        values = self._match_pairs(tree, first[indexes], second[indexes])
+
+        computed = dict(zip(missing, values.tolist()))
+        if computed:
+            self.similarity_cache.set_many(computed)
+        similarities.update(computed)
+
+        return np.array([similarities[key] for key in keys], np.float)
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(self.n_threads)
+        return self._pool
+
+    def close(self):
+        """terminate the thread pool of ``n_threads``, it's started again when needed.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def hcluster(self, m):
-        """hierarchy clustering base on the given similarity matrix.
+        """hierarchy clustering base on the given similarity matrix, with the
+        ``clustering`` backend.
         """
-        L = sch.linkage(m, method='complete')
-        ind = sch.fcluster(L, self.threshold, 'distance')
-        return ind.tolist()
+        return self.clustering(m, self.threshold)
+
+def pair_indices(n, k):
+    """the pairs ``(first, second)`` at the positions ``k`` of the pairs of ``np.triu_indices(n, 1)``,
+    without building all the pairs.
+
+    >>> first, second = pair_indices(4, np.array([0, 2, 3, 5]))
+    >>> first.tolist(), second.tolist()
+    ([0, 0, 1, 2], [1, 3, 2, 3])
+    """
+    rows = np.arange(n)
+    starts = rows * (n - 1) - rows * (rows - 1) // 2
+    first = np.searchsorted(starts, k, 'right') - 1
+    return first, first + 1 + k - starts[first]
 
 class RecordFinder(object):
     """
     A class to find the record from a list of elements.
+
+    Parameters
+    ----------
+    cache: optional
+        the similarities of the pairs of elements, a dict or a ``TreeSimilarityCache``.
+
+    sample_pairs: int, optional
+        estimate the average similarity of a division from a random sample of this
+        many pairs of records, instead of scoring all the pairs exactly.
+
+    random_state: int
+        the seed of the sample of pairs.
     """
-    def __init__(self, cache={}):
-        self.tree_similarity_cache = dict(cache)
+    # the number of pairs of records scored between two checks of the upper bound
+    chunk_size = 256
+
+    def __init__(self, cache=None, sample_pairs=None, random_state=0):
+        self.tree_similarity_cache = cache if cache is not None else {}
+        self.sample_pairs = sample_pairs
+        self.random_state = random_state
 
     def find_best_division(self, elements, clusters):
         """find the best record division
 
+        The division with the highest average similarity of its pairs of records wins,
+        the first one on ties. The divisions are scored by decreasing upper bound: a
+        pair of records of ``l1`` and ``l2`` trees scores at most ``min(l1, l2) / (max(l1, l2) + 1)``,
+        so a division stops being scored as soon as it can't beat the best one.
+
+        The bound assumes the similarity of two trees is at most 1, as the tree matchers
+        give it: the similarities of the cache are clipped to 1, otherwise a division could
+        be skipped while it was the best.
+
         Parameters
         ----------
         elements: list
@@ -194,24 +892,71 @@ class RecordFinder(object):
         if len(set(clusters)) == len(clusters):
             return None
 
-        all_records = []
+        # only the bound of each division is kept, its records are built when it's scored
+        divisions = []
+        for order, c in enumerate(set(clusters)):
+            lengths = [len(group) for group in split_sequence(clusters, lambda x: x == c)
+                       if len(group) < len(clusters)]
+            if lengths:
+                divisions.append((self._division_bound(lengths), order, c))
 
-        for c in set(clusters):
-            records = []
-            for group in split_sequence(zip(elements, clusters), lambda x: x[1] == c):
-                _clusters = [g[1] for g in group]
-                if len(_clusters) < len(clusters):
-                    records.append(Record(*[g[0] for g in group]))
+        if not divisions:
+            return None
 
-            if not records:
+        best = None
+        for bound, order, c in sorted(divisions, key=lambda d: (-d[0], d[1])):
+            if best is not None and not self._can_beat(bound, order, best):
                 continue
+            records = self.find_division(elements, clusters, c)
+            average_sim = self._score_division(records, order, best)
+            if average_sim is not None and (best is None or (average_sim, -order) > (best[0], -best[1])):
+                best = average_sim, order, records
 
-            similarities = [self.calculate_record_similarity(r1, r2) for r1, r2 in itertools.combinations(records, 2)]
-            average_sim = sum(similarities) / (len(similarities) + 1)
+        return best[2]
 
-            all_records.append([average_sim, records])
+    @staticmethod
+    def _division_bound(lengths):
+        """the upper bound of the average similarity of the pairs of records of the given lengths.
 
-        return max(all_records, key=operator.itemgetter(0))[1]
+        With the lengths sorted, the pairs of a record with the shorter ones are bound
+        by the sum of their lengths over its own length plus 1.
+
+        >>> RecordFinder._division_bound([2, 1, 2]) == (1 / 3. + 2 / 3. + 1 / 3.) / 4
+        True
+        """
+        lengths = np.sort(np.asarray(lengths, np.float))
+        shorter = np.cumsum(lengths) - lengths
+        return (shorter / (lengths + 1)).sum() / (len(lengths) * (len(lengths) - 1) // 2 + 1)
+
+    def _can_beat(self, bound, order, best):
+        # the bound is a sum of floats, leave some room for rounding
+        return bound + 1e-9 >= best[0] if order < best[1] else bound + 1e-9 > best[0]
+
+    def _score_division(self, records, order, best):
+        """the average similarity of the pairs of records of a division, None if
+        it stops being scored because it can't beat the ``best`` one.
+        """
+        similarity = self._record_scorer(records)
+        lengths = np.array([len(r) for r in records], np.float)
+        n_pairs = len(records) * (len(records) - 1) // 2
+
+        if self.sample_pairs is not None and n_pairs > self.sample_pairs:
+            rng = np.random.RandomState(self.random_state)
+            sample = np.sort(rng.choice(n_pairs, self.sample_pairs, replace=False))
+            similarities = similarity(*pair_indices(len(records), sample))
+            return sum(similarities) / len(similarities) * n_pairs / (n_pairs + 1)
+
+        similarities = []
+        remaining = self._division_bound(lengths) * (n_pairs + 1)
+        for k in xrange(0, n_pairs, self.chunk_size):
+            first, second = pair_indices(len(records), np.arange(k, min(k + self.chunk_size, n_pairs)))
+            similarities.extend(similarity(first, second))
+            l1, l2 = lengths[first], lengths[second]
+            remaining -= (np.minimum(l1, l2) / (np.maximum(l1, l2) + 1)).sum()
+            if best is not None and not self._can_beat((sum(similarities) + remaining) / (n_pairs + 1), order, best):
+                return None
+
+        return sum(similarities) / (len(similarities) + 1)
 
     def find_division(self, elements, clusters, cluster):
         """ find the division with given cluster as seperator
@@ -246,23 +991,81 @@ class RecordFinder(object):
     def calculate_record_similarity(self, r1, r2):
         """calculate similarity between two Records.
         """
+        m = np.zeros((len(r1), len(r2)), np.float)
+        for i in xrange(len(r1)):
+            for j in xrange(len(r2)):
+                sim = self.tree_similarity_cache.get((r1[i], r2[j]))
+                assert sim != None, 'tree %s %s not in cache' % (r1[i], r2[j])
+                # the bounds of ``find_best_division`` hold for the similarities up to 1
+                m[i, j] = min(sim, 1.0)
+
+        return record_similarity(m)
+
+    def calculate_record_similarities(self, records):
+        """calculate the similarity of each pair of the given Records, in the order
+        of ``itertools.combinations``.
+
+        When a similarity matrix of the cache covers all the trees of the records,
+        the pairs are scored at once on that matrix.
+        """
+        first, second = np.triu_indices(len(records), 1)
+        return self._record_scorer(records)(first, second)
 
-        m = np.zeros((len(r1)+1, len(r2)+1), np.float)
+    def _record_scorer(self, records):
+        """get a function scoring the pairs ``(records[first[k]], records[second[k]])``.
+        """
+        found = None
+        if hasattr(self.tree_similarity_cache, 'get_matrix'):
+            found = self.tree_similarity_cache.get_matrix([t for r in records for t in r])
 
-        for i in xrange(1, len(m)):
-            for j in xrange(1, len(m[0])):
-                sim = self.tree_similarity_cache.get((r1[i - 1], r2[j - 1]))
-                assert sim != None, 'tree %s %s not in cache' % (r1[i-1], r2[j-1])
-                m[i, j] = max(m[i, j - 1], m[i - 1, j], m[i - 1][j - 1] + sim)
+        if found is None:
+            return lambda first, second: [self.calculate_record_similarity(records[i], records[j])
+                                          for i, j in zip(first, second)]
 
-        return m[i, j] / max(m.shape[0], m.shape[1])
+        m = np.ascontiguousarray(np.minimum(found[0], 1.0), np.float)
+        rows = np.array(found[1], np.intc)
+        lengths = np.array([len(r) for r in records], np.intc)
+        starts = (np.cumsum(lengths) - lengths).astype(np.intc)
+
+        def score(first, second):
+            out = np.zeros(len(first), np.float)
+            record_similarities(m, rows, starts, lengths, first.astype(np.intc), second.astype(np.intc), out)
+            return out.tolist()
+        return score
 
 class RecordAligner(object):
+    """
+    Align the data records to a seed record with partial tree alignment.
 
-    def __init__(self):
-        self.pta = PartialTreeAligner()
+    Parameters
+    ----------
+    memo: ``SimilarityMemo``, optional
+        keep the alignment score of the subtrees by their fingerprint.
+
+    native: bool
+        align the trees with the native ``CompactTreeAligner``.
+
+    scheduler: str or scheduler
+        the order of the alignments, one of 'fifo' (the records in order, the default)
+        and 'benefit' (the records in order, then the requeued records with the most
+        unaligned nodes first), see ``mdr.scheduling``.
+
+    max_rounds: int, optional
+        the maximum number of times a record is aligned, no limit by default: the
+        records are only requeued when the seed grows, see ``FIFOScheduler``.
 
-    def align(self, records, record=None):
+    cache_size: int
+        the capacity of the ``AlignmentCache`` of the subtree alignments reused when a
+        record is aligned again after a modification of the seed, 0 to disable it.
+    """
+
+    def __init__(self, memo=None, native=False, scheduler='fifo', max_rounds=None, cache_size=100000):
+        self.cache = AlignmentCache(cache_size) if cache_size else None
+        self.pta = PartialTreeAligner(memo, native, self.cache)
+        self.scheduler = get_scheduler(scheduler, max_rounds)
+        self._stats = {}
+
+    def align(self, records, record=None, materialize=True):
         """Partial align multiple data records with partial tree match [1]_
 
         Parameters
@@ -274,12 +1077,18 @@ class RecordAligner(object):
             The seed record learned before.
             used to speed up the extraction without finding the seed elements.
 
+        materialize: bool
+            the records are aligned to a virtual seed of ``SeedNode`` referring to the
+            elements of the records, return it as lxml trees (the default) or as is.
+            A virtual seed can be built later with ``materialize``.
+
         Returns
         -------
         seed_record: ``Record``
              the seed record to match against other record trees.
 
-        mappings: a dict with record as key and a nested dict map from seed element to aligned element.
+        mappings: ``RecordMappings``
+            the mapping from the seed elements to the aligned elements of each record.
 
         References
         ----------
@@ -294,42 +1103,177 @@ class RecordAligner(object):
             seed = max(records, key=Record.size)
             records.remove(seed)
 
-        seed_copy = copy.deepcopy(seed)
-
-        mappings = collections.OrderedDict({seed: self._create_mapping(seed_copy, seed)})
-
-        R = []
-        while len(records):
-            next = records.pop(0)
-            modified, partial_match, aligned = self.pta.align_records(seed_copy, next)
-
-            mappings.update({next: aligned})
-
-            if modified:
-                records.extend(R)
-                R = []
-            else:
-                # add it back to try it later since seed might change
-                if partial_match:
-                    R.append(next)
-
+        # the seed is aligned as a virtual tree referring to the elements of the seed and
+        # of the records, rather than as a deep copy
+        seed_copy = Record(*[SeedNode(tree) for tree in seed])
+
+        # the index of the seed is kept up to date across the alignments, its elements
+        # are numbered as they are looked up so the preorder is only known at the end
+        index = SeedIndex(seed_copy)
+        # the pairs of the seed are known once its nodes are all created
+        pairs = collections.OrderedDict([(seed, None)])
+
+        start = time.time()
+        self.scheduler.start(records)
+        del records[:]
+        try:
+            while True:
+                next = self.scheduler.pop()
+                if next is None:
+                    break
+                modified, partial_match, aligned = self.pta.align_records(seed_copy, next, index)
+                pairs[next] = self._index_pairs(index, next, aligned)
+                self.scheduler.done(next, modified, partial_match, aligned)
+        finally:
+            # the alignments refer to this seed and these records only, don't keep them alive
+            if self.cache is not None:
+                self.cache.clear()
+
+        self._stats = dict(self.scheduler.stats, time=time.time() - start)
+        # the seed is aligned to the nodes referring to its own elements
+        sources = dict((e, i) for i, e in enumerate(iter_nodes(seed)))
+        items = [(index.id(node), sources[node.source]) for node in iter_nodes(seed_copy) if node.source in sources]
+        pairs[seed] = tuple(np.array(items, np.intc).reshape(-1, 2).T)
+        mappings = self._create_mappings(seed_copy, index.ids, pairs)
+        if materialize:
+            seed_copy = mappings.seed = self.materialize(seed_copy, seed.fields)
         return seed_copy, mappings
 
-    def _create_mapping(self, seed, tree):
-        """create a mapping from seed tree to another tree.
+    def materialize(self, seed, fields=None):
+        """
+        build the lxml trees of a virtual seed record returned by ``align``.
+
+        The names of the fields of the source elements in ``fields`` are kept
+        by the new elements.
+        """
+        record = Record(*[tree.materialize() for tree in seed])
+        if fields:
+            for node, e in zip(iter_nodes(seed), iter_nodes(record)):
+                if node.source in fields:
+                    record.fields[e] = fields[node.source]
+        return record
+
+    def stats(self):
+        """
+        get the statistics of the last alignment: the number of alignments (iterations),
+        of records requeued after a modification of the seed (requeues) and of records
+        dropped after ``max_rounds`` alignments (dropped), and the time spent.
+        """
+        return dict(self._stats)
 
-        for example:
+    def _index_pairs(self, index, record, aligned):
+        """
+        turn the mapping from the seed elements to the record elements into
+        arrays of seed element numbers and record node indexes.
+        """
+        record_nodes = dict((e, i) for i, e in enumerate(iter_nodes(record)))
+        items = [(index.id(k), record_nodes[v])
+                 for k, v in aligned.iteritems() if k is not None]
+        return tuple(np.array(items, np.intc).reshape(-1, 2).T)
 
-        >>> from lxml.html import fragment_fromstring
-        >>> t1 = fragment_fromstring("<p> <a></a> <b></b> </p>")
-        >>> t2 = fragment_fromstring("<p> <a></a> <b></b> </p>")
-        >>> ra = RecordAligner()
-        >>> d = ra._create_mapping(Record(t1), Record(t2))
-        >>> d[t1] == t2
-        True
+    def _create_mappings(self, seed, seed_ids, pairs):
         """
-        d = {}
-        for s, e in zip(seed, tree):
-            d[s] = e
-            d.update(self._create_mapping(s, e))
-        return d
+        pack the index pairs of the records in a ``RecordMappings`` over the preorder of the seed.
+        """
+        positions = np.zeros(len(seed_ids), np.intc)
+        for i, e in enumerate(iter_nodes(seed)):
+            if e in seed_ids:
+                positions[seed_ids[e]] = i
+
+        seed_nodes, record_nodes, offsets = [], [], [0]
+        for ids, nodes in pairs.itervalues():
+            ids = positions[ids]
+            order = np.argsort(ids, kind='mergesort')
+            seed_nodes.append(ids[order])
+            record_nodes.append(nodes[order])
+            offsets.append(offsets[-1] + len(ids))
+
+        return RecordMappings(seed, pairs.keys(), offsets, np.concatenate(seed_nodes), np.concatenate(record_nodes))
+
+class _BufferReader(object):
+    """
+    A file-like object over a bytes-like object, the parser reads it chunk by chunk.
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def read(self, size=-1):
+        end = len(self.buf) if size < 0 else min(self.pos + size, len(self.buf))
+        chunk = self.buf[self.pos:end]
+        self.pos = end
+        return chunk.tobytes() if isinstance(chunk, memoryview) else str(chunk)
+
+# the ``MDR`` of the current worker process, see ``MDR.extract_many``.
+_worker_mdr = None
+
+def _init_worker(config):
+    global _worker_mdr
+    _worker_mdr = MDR(**config)
+
+def _wait(get, workers, timeout):
+    # poll ``get`` to notice the dead workers, their chunk never completes
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        wait = 1.0 if deadline is None else max(0.0, min(1.0, deadline - time.time()))
+        try:
+            return get(wait)
+        except (TimeoutError, Empty):
+            if any(worker.exitcode is not None for worker in workers):
+                raise RuntimeError('a worker process of extract_many died')
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError('no result of extract_many in %s seconds' % timeout)
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _extract_pages(pages):
+    return [_extract_page(i, html, encoding) for i, (html, encoding) in pages]
+
+def _extract_pages_or_error(pages):
+    # the callback of ``apply_async`` only gets the successful results, so the
+    # errors are sent back as a result to be raised by ``extract_many``
+    try:
+        return _extract_pages(pages), None
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = RuntimeError('%s: %s' % (e.__class__.__name__, e))
+        return None, e
+
+def _extract_page(index, html, encoding):
+    result = {'index': index, 'candidate': None, 'seed': [], 'fields': [], 'records': [], 'error': None}
+    try:
+        candidates, doc = _worker_mdr.list_candidates(html, encoding)
+        if not candidates:
+            return result
+        result['candidate'] = doc.getpath(candidates[0])
+        seed_record, mappings = _worker_mdr.extract(candidates[0])
+    except Exception as e:
+        result['error'] = '%s: %s' % (e.__class__.__name__, e)
+        return result
+    finally:
+        # the cache is keyed by elements of this page only
+        _worker_mdr.tree_sim_cache.clear()
+
+    if seed_record is None:
+        return result
+
+    fields = [(k, node) for k, seed_tree in enumerate(seed_record) for node in seed_tree.iter()]
+    result['seed'] = [doc.getpath(seed_tree) for seed_tree in mappings.keys()[0]]
+    result['fields'] = [(k, node.getroottree().getpath(node)) for k, node in fields]
+    for record, mapping in mappings.iteritems():
+        result['records'].append({
+            'xpaths': [doc.getpath(tree) for tree in record],
+            'texts': [mapping[node].text if node in mapping else None for _, node in fields],
+        })
+    return result
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+The schedulers of the records aligned by ``RecordAligner.align``.
+
+The records partially aligned to the seed are aligned again once the seed is
+modified, a scheduler decides the order of the alignments and how many times a
+record is aligned at most. It counts the alignments and the records requeued
+on the way.
+"""
+import collections
+import heapq
+
+class FIFOScheduler(object):
+    """
+    Align the records in order, the records left partially aligned are queued
+    again at the end after each modification of the seed.
+
+    It's the original order of ``RecordAligner.align``.
+
+    Parameters
+    ----------
+    max_rounds: int, optional
+        the maximum number of times a record is aligned, a partially aligned record
+        is dropped rather than requeued once it's reached. No limit by default, as
+        in the original algorithm: a record is only requeued after the seed took
+        new nodes from the records, so it's aligned at most once more than the
+        number of their nodes.
+
+    >>> scheduler = FIFOScheduler(max_rounds=1)
+    >>> scheduler.start(['a', 'b'])
+    >>> scheduler.pop()
+    'a'
+    >>> scheduler.done('a', False, True, {})
+    >>> scheduler.pop()
+    'b'
+    >>> scheduler.done('b', True, False, {})
+    >>> scheduler.pop() is None, sorted(scheduler.stats.items())
+    (True, [('dropped', 1), ('iterations', 2), ('requeues', 0)])
+    """
+
+    def __init__(self, max_rounds=None):
+        self.max_rounds = max_rounds
+
+    def start(self, records):
+        """
+        start scheduling the given records.
+        """
+        self.rounds = collections.Counter()
+        self.waiting = []
+        self.stats = {'iterations': 0, 'requeues': 0, 'dropped': 0}
+        self._queue = collections.deque()
+        for record in records:
+            self._push(record)
+
+    def _push(self, record):
+        self._queue.append(record)
+
+    def _pop(self):
+        return self._queue.popleft()
+
+    def pop(self):
+        """
+        get the next record to align, None when they're all done.
+        """
+        try:
+            return self._pop()
+        except IndexError:
+            return None
+
+    def done(self, record, modified, partial_match, aligned):
+        """
+        take the result of the alignment of the record, see ``PartialTreeAligner.align_records``.
+        """
+        self.stats['iterations'] += 1
+        self.rounds[record] += 1
+        if modified:
+            for waiting in self.waiting:
+                if self.max_rounds is not None and self.rounds[waiting] >= self.max_rounds:
+                    self.stats['dropped'] += 1
+                else:
+                    self._push(waiting)
+                    self.stats['requeues'] += 1
+            self.waiting = []
+        elif partial_match:
+            # try it later since the seed might change
+            self.waiting.append(record)
+
+class BenefitScheduler(FIFOScheduler):
+    """
+    Align the records in order first, then requeue the records partially aligned
+    with the most nodes left unaligned first, they are the most likely to modify
+    the seed.
+
+    The first round is the same as ``FIFOScheduler``, so is the seed when every
+    record is aligned at once. Otherwise the records are requeued in a different
+    order and the seed might differ. A requeued record takes the number of its nodes
+    left unaligned by its last alignment, the ties are broken by the order of the records.
+
+    >>> scheduler = BenefitScheduler()
+    >>> scheduler.start(['x'])
+    >>> for name, unaligned in [('a', 1), ('b', 5), ('c', 3)]:
+    ...     scheduler.benefits[name] = unaligned
+    ...     scheduler._push(name)
+    >>> [scheduler.pop() for _ in range(5)]
+    ['x', 'b', 'c', 'a', None]
+    """
+
+    def start(self, records):
+        self.benefits = {}
+        self._order = {}
+        self._heap = []
+        super(BenefitScheduler, self).start(records)
+
+    def _push(self, record):
+        # the records of the first round don't have a benefit yet
+        if record not in self.benefits:
+            return super(BenefitScheduler, self)._push(record)
+        order = self._order.setdefault(record, len(self._order))
+        heapq.heappush(self._heap, (-self.benefits[record], order, record))
+
+    def _pop(self):
+        if self._queue:
+            return self._queue.popleft()
+        return heapq.heappop(self._heap)[-1]
+
+    def done(self, record, modified, partial_match, aligned):
+        self.benefits[record] = max(record.size() - len(aligned), 0)
+        super(BenefitScheduler, self).done(record, modified, partial_match, aligned)
+
+SCHEDULERS = {
+    'fifo': FIFOScheduler,
+    'benefit': BenefitScheduler,
+}
+
+def get_scheduler(scheduler, max_rounds=None):
+    """
+    get the scheduler by its name in ``SCHEDULERS``, a scheduler instance is returned as is.
+
+    >>> get_scheduler('benefit', max_rounds=3).max_rounds
+    3
+    """
+    if not isinstance(scheduler, basestring):
+        return scheduler
+    try:
+        return SCHEDULERS[scheduler](max_rounds)
+    except KeyError:
+        raise ValueError('unknown scheduler: %r' % scheduler)
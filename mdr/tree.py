@@ -2,18 +2,43 @@
 import numpy as np
 import copy
 
-from .utils import find_continous_subsequence, reverse_dict
-from ._tree import _clustered_tree_match, _simple_tree_match, tree_size
+from .utils import find_continous_subsequence
+from ._tree import (_clustered_tree_match, _simple_tree_match, tree_size, CompactTree, CompactTreeAligner,
+                    TREE_ALIGNMENT)
 
-def normalized_simple_tree_match(t1, t2):
+def normalized_simple_tree_match(t1, t2, memo=None):
     t1size = tree_size(t1)
     t2size = tree_size(t2)
-    return _simple_tree_match(t1, t2) / (2.0 * (t1size + t2size))
-
-def clustered_tree_match(t1, t2, c1=1, c2=1):
-    return _clustered_tree_match(t1, t2, c1, c2)
+    return _simple_tree_match(t1, t2, memo) / (2.0 * (t1size + t2size))
+
+def clustered_tree_match(t1, t2, c1=1, c2=1, memo=None):
+    return _clustered_tree_match(t1, t2, c1, c2, memo)
+
+def compact_tree(tree):
+    """
+    get the ``CompactTree`` of an lxml element or of a ``SeedNode``, the compact
+    tree of a seed node is kept until the subtree is modified.
+    """
+    if isinstance(tree, CompactTree):
+        return tree
+    if isinstance(tree, SeedNode):
+        return tree.compact_tree()
+    return CompactTree(tree)
 
 class TreeAlignment(object):
+    """
+    The alignment of two trees: the aligned roots and the alignments of their descendants.
+
+    ``subs`` is the flat list of the aligned descendants, it's only flattened when
+    it's read, so adding the alignments level by level takes linear time.
+
+    >>> a, b, c = TreeAlignment('a', 'A'), TreeAlignment('b', 'B'), TreeAlignment('c', 'C')
+    >>> b.add(c)
+    >>> a.add(b)
+    >>> [(sub.first, sub.second) for sub in a.subs]
+    [('b', 'B'), ('c', 'C')]
+    """
+    __slots__ = ('first', 'second', 'score', '_children')
 
     TRACE_LEFT = 1
     TRACE_UP = 2
@@ -23,14 +48,38 @@ class TreeAlignment(object):
         self.first = first
         self.second = second
         self.score = score
-        self.subs = []
+        # the added alignments and whether they are aligned pairs themselves,
+        # or only stand for their subs
+        self._children = []
 
     def add(self, alignment):
         if self.first is None and self.second is None:
             self.first, self.second = alignment.first, alignment.second
+            self._children.append((alignment, False))
         else:
-            self.subs.append(alignment)
-        self.subs.extend(alignment.subs)
+            self._children.append((alignment, True))
+
+    def iter_subs(self):
+        """
+        iterate over the aligned descendants, same as ``subs``.
+        """
+        stack = [iter(self._children)]
+        while stack:
+            for alignment, aligned in stack[-1]:
+                if aligned:
+                    yield alignment
+                stack.append(iter(alignment._children))
+                break
+            else:
+                stack.pop()
+
+    @property
+    def subs(self):
+        return list(self.iter_subs())
+
+    @subs.setter
+    def subs(self, alignments):
+        self._children = [(alignment, True) for alignment in alignments]
 
     @property
     def tag(self):
@@ -41,6 +90,23 @@ class TreeAlignment(object):
         return '{} {}: {}'.format(self.first, self.subs, self.score)
 
 class SimpleTreeAligner(object):
+    """
+    Align DOM trees with simple tree matching.
+
+    Parameters
+    ----------
+    memo: ``SimilarityMemo``, optional
+        keep the alignment score of the subtrees by their fingerprint, so the
+        alignments of subtrees with the same structure are only computed once.
+
+    cache: ``AlignmentCache``, optional
+        keep the alignments of the subtrees of a virtual seed (see ``SeedNode``), so
+        they're reused until the subtree is modified.
+    """
+
+    def __init__(self, memo=None, cache=None):
+        self.memo = memo
+        self.cache = cache
 
     def align_records(self, r1, r2):
         """
@@ -48,6 +114,10 @@ class SimpleTreeAligner(object):
         """
         alignment = TreeAlignment()
 
+        if self.memo is not None:
+            r1 = [compact_tree(t) for t in r1]
+            r2 = [compact_tree(t) for t in r2]
+
         m = np.zeros((len(r1)+1, len(r2)+1), np.int)
         align_matrix = np.array([[0 for _ in range(len(r2))] for _ in range(len(r1))], np.object)
         trace = np.zeros((len(r1), len(r2)), np.int)
@@ -87,13 +157,26 @@ class SimpleTreeAligner(object):
     def align_tree(self, t1, t2):
         """
         align two DOM trees.
+
+        the trees can be either lxml elements or ``CompactTree``.
         """
         if t1 is None or t2 is None:
             return TreeAlignment()
 
+        if self.memo is not None:
+            t1 = compact_tree(t1)
+            t2 = compact_tree(t2)
+
+        if isinstance(t1, CompactTree) and isinstance(t2, CompactTree):
+            return self._align_compact_tree(t1, 0, t2, 0)
+
         if t1.tag != t2.tag:
             return TreeAlignment()
 
+        cached = self._cached_alignment(t1, t2)
+        if cached is not None:
+            return cached
+
         alignment = TreeAlignment(t1, t2)
 
         m = np.zeros((len(t1)+1, len(t2)+1), np.int)
@@ -139,17 +222,418 @@ class SimpleTreeAligner(object):
         if t1.attrib.get('itemprop') and t1.attrib.get('itemprop') == t2.attrib.get('itemprop'):
             alignment.score += 1
 
+        self._cache_alignment(t1, t2, alignment)
         return alignment
 
-class PartialTreeAligner(object):
+    def _align_compact_tree(self, t1, i1, t2, i2):
+        """
+        align node ``i1`` of ``t1`` with node ``i2`` of ``t2``, same as ``align_tree``
+        but works on the arrays of the ``CompactTree``.
+        """
+        if t1.tags[i1] != t2.tags[i2]:
+            return TreeAlignment()
+
+        cached = self._cached_alignment(t1.elements[i1], t2.elements[i2])
+        if cached is not None:
+            return cached
 
-    def __init__(self):
-        self.sta = SimpleTreeAligner()
+        alignment = TreeAlignment(t1.elements[i1], t2.elements[i2])
+
+        children1 = t1.child_nodes(i1)
+        children2 = t2.child_nodes(i2)
+
+        m = np.zeros((len(children1)+1, len(children2)+1), np.int)
+        align_matrix = np.array([[0 for _ in range(len(children2))] for _ in range(len(children1))], np.object)
+        trace = np.zeros((len(children1), len(children2)), np.int)
+
+        for i in xrange(1, m.shape[0]):
+            for j in xrange(1, m.shape[1]):
+                if m[i, j - 1] > m[i - 1, j]:
+                    m[i, j] = m[i, j - 1]
+                    trace[i - 1, j - 1] = TreeAlignment.TRACE_LEFT
+                else:
+                    m[i, j] = m[i - 1, j]
+                    trace[i - 1, j - 1] = TreeAlignment.TRACE_UP
+                child_score = self._memoized_score(t1, children1[i - 1], t2, children2[j - 1])
+                if child_score is None:
+                    align_matrix[i - 1, j - 1] = self._align_compact_tree(t1, children1[i - 1], t2, children2[j - 1])
+                    child_score = align_matrix[i - 1, j - 1].score
+                    self._memoize_score(t1, children1[i - 1], t2, children2[j - 1], child_score)
+                else:
+                    align_matrix[i - 1, j - 1] = None
+                score = m[i - 1, j - 1] + child_score
+                if score > m[i, j]:
+                    m[i, j] = score
+                    trace[i - 1, j - 1] = TreeAlignment.TRACE_DIAG
+
+        row = len(children1) - 1
+        col = len(children2) - 1
+
+        while row >= 0 and col >= 0:
+            if trace[row, col] == TreeAlignment.TRACE_DIAG:
+                if align_matrix[row, col] is None:
+                    # only the score was memoized, align the winning pair now
+                    align_matrix[row, col] = self._align_compact_tree(t1, children1[row], t2, children2[col])
+                alignment.add(align_matrix[row, col])
+                row -= 1
+                col -= 1
+            elif trace[row, col] == TreeAlignment.TRACE_UP:
+                row -= 1
+            elif trace[row, col] == TreeAlignment.TRACE_LEFT:
+                col -= 1
+
+        alignment.score = 1 + m[-1, -1]
+
+        if t1.classes[i1] and t1.classes[i1] == t2.classes[i2]:
+            alignment.score += 1
+
+        if t1.itemprops[i1] and t1.itemprops[i1] == t2.itemprops[i2]:
+            alignment.score += 1
+
+        self._cache_alignment(t1.elements[i1], t2.elements[i2], alignment)
+        return alignment
+
+    def _cached_alignment(self, e1, e2):
+        # leaves are cheaper to align than to look up
+        if self.cache is None or not isinstance(e1, SeedNode) or not len(e1) or not len(e2):
+            return None
+        return self.cache.get(e1, e2)
+
+    def _cache_alignment(self, e1, e2, alignment):
+        if self.cache is None or not isinstance(e1, SeedNode) or not len(e1) or not len(e2):
+            return
+        self.cache.set(e1, e2, alignment)
+
+    def _memoized_score(self, t1, i1, t2, i2):
+        # leaves and different tags are cheaper to align than to look up
+        if self.memo is None or t1.sizes[i1] == 1 or t2.sizes[i2] == 1 or t1.tags[i1] != t2.tags[i2]:
+            return None
+        score = self.memo.get(TREE_ALIGNMENT, t1.class_hashes[i1], t2.class_hashes[i2])
+        return None if score is None else int(score)
+
+    def _memoize_score(self, t1, i1, t2, i2, score):
+        if self.memo is None or t1.sizes[i1] == 1 or t2.sizes[i2] == 1 or t1.tags[i1] != t2.tags[i2]:
+            return
+        self.memo.set(TREE_ALIGNMENT, t1.class_hashes[i1], t2.class_hashes[i2], value=score)
+
+class NativeTreeAligner(SimpleTreeAligner):
+    """
+    Align DOM trees like ``SimpleTreeAligner`` with the native ``CompactTreeAligner``.
+
+    Only the scores and the traceback of the winning alignment are computed, the
+    ``TreeAlignment`` of the aligned pairs are built at the end. The aligned elements
+    are the same as ``SimpleTreeAligner``, but the ``subs`` of the returned alignment
+    are flat: the ``subs`` of each sub alignment are left empty.
+
+    Parameters
+    ----------
+    memo: ``SimilarityMemo``, optional
+        keep the alignment score of the subtrees by their fingerprint.
+
+    >>> from lxml.html import fragment_fromstring
+    >>> t1 = fragment_fromstring("<p> <a></a> <b></b> <e></e> </p>")
+    >>> t2 = fragment_fromstring("<p> <b></b> <c></c> <e></e> </p>")
+    >>> alignment = NativeTreeAligner().align_tree(t1, t2)
+    >>> alignment.score, [(sub.first.tag, sub.second.tag) for sub in alignment.subs]
+    (3, [('e', 'e'), ('b', 'b')])
+    """
+
+    def __init__(self, memo=None, cache=None):
+        super(NativeTreeAligner, self).__init__(memo, cache)
+        self.aligner = CompactTreeAligner(memo)
 
     def align_records(self, r1, r2):
+        """
+        Align two records.
+        """
+        alignment = TreeAlignment()
+        r1 = [compact_tree(t) for t in r1]
+        r2 = [compact_tree(t) for t in r2]
+
+        # only the scores of the tree pairs, the winning ones are aligned afterward
+        m = [[0] * (len(r2) + 1) for _ in range(len(r1) + 1)]
+        trace = [[0] * len(r2) for _ in range(len(r1))]
+        # the scores are reused to align the winning pairs
+        scores = [[None] * len(r2) for _ in range(len(r1))]
+
+        for i in xrange(1, len(r1) + 1):
+            for j in xrange(1, len(r2) + 1):
+                if m[i][j - 1] > m[i - 1][j]:
+                    m[i][j] = m[i][j - 1]
+                    trace[i - 1][j - 1] = TreeAlignment.TRACE_LEFT
+                else:
+                    m[i][j] = m[i - 1][j]
+                    trace[i - 1][j - 1] = TreeAlignment.TRACE_UP
+                cached = self._cached_alignment(r1[i - 1].elements[0], r2[j - 1].elements[0])
+                if cached is None:
+                    scores[i - 1][j - 1] = self.aligner.score(r1[i - 1], 0, r2[j - 1], 0)
+                    score = m[i - 1][j - 1] + scores[i - 1][j - 1]
+                else:
+                    score = m[i - 1][j - 1] + cached.score
+                if score > m[i][j]:
+                    m[i][j] = score
+                    trace[i - 1][j - 1] = TreeAlignment.TRACE_DIAG
+
+        row = len(r1) - 1
+        col = len(r2) - 1
+
+        while row >= 0 and col >= 0:
+            if trace[row][col] == TreeAlignment.TRACE_DIAG:
+                alignment.add(self._align_compact_trees(r1[row], r2[col], scores[row][col]))
+                row -= 1
+                col -= 1
+            elif trace[row][col] == TreeAlignment.TRACE_UP:
+                row -= 1
+            elif trace[row][col] == TreeAlignment.TRACE_LEFT:
+                col -= 1
+
+        alignment.score = m[-1][-1]
+        # the buffers of the largest tree pairs aren't kept
+        self.aligner.release()
+        return alignment
+
+    def align_tree(self, t1, t2):
+        """
+        align two DOM trees.
+
+        the trees can be either lxml elements or ``CompactTree``.
+        """
+        if t1 is None or t2 is None:
+            return TreeAlignment()
+
+        return self._align_compact_trees(compact_tree(t1), compact_tree(t2))
+
+    def _align_compact_trees(self, t1, t2, score=None):
+        cached = self._cached_alignment(t1.elements[0], t2.elements[0])
+        if cached is not None:
+            return cached
+
+        score, pairs = self.aligner.align(t1, 0, t2, 0, score)
+        if not pairs:
+            return TreeAlignment()
+
+        alignment = TreeAlignment(t1.elements[0], t2.elements[0], score)
+        alignment.subs = [TreeAlignment(t1.elements[i1], t2.elements[i2], s) for i1, i2, s in pairs[1:]]
+        self._cache_alignment(t1.elements[0], t2.elements[0], alignment)
+        return alignment
+
+class SeedNode(object):
+    """
+    A node of a virtual seed tree, standing for its ``source`` element without copying it.
+
+    The partial tree aligner inserts the unaligned elements of the records in the
+    seed, with a virtual seed it only inserts nodes referring to them. The node
+    mimics the part of the lxml element API used by the aligners, its children are
+    only created when they are visited. ``materialize`` builds the lxml tree, the
+    subtrees without insertions are deep copies of their source.
+
+    >>> from lxml.html import fragment_fromstring
+    >>> t = fragment_fromstring("<p> <a></a> <b></b> </p>")
+    >>> seed = SeedNode(t)
+    >>> seed.insert(1, SeedNode(fragment_fromstring("<c><d></d></c>")))
+    >>> [e.tag for e in seed.iter()]
+    ['p', 'a', 'c', 'd', 'b']
+    >>> from lxml import etree
+    >>> etree.tostring(seed.materialize()), etree.tostring(t)
+    ('<p> <a/> <c><d/></c><b/> </p>', '<p> <a/> <b/> </p>')
+    """
+    __slots__ = ('source', 'parent', 'modified', 'version', '_children', '_compact_tree')
+
+    def __init__(self, source, parent=None):
+        self.source = source
+        self.parent = parent
+        # whether nodes were inserted in the subtree
+        self.modified = False
+        # the number of insertions in the subtree
+        self.version = 0
+        self._children = None
+        self._compact_tree = None
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = [SeedNode(child, self) for child in self.source]
+        return self._children
+
+    @property
+    def tag(self):
+        return self.source.tag
+
+    @property
+    def attrib(self):
+        return self.source.attrib
+
+    def get(self, key, default=None):
+        return self.source.get(key, default)
+
+    def __len__(self):
+        return len(self.source) if self._children is None else len(self._children)
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __getitem__(self, i):
+        return self.children[i]
+
+    def __repr__(self):
+        return '<SeedNode %r>' % self.source
+
+    def iter(self):
+        """
+        iterate over the nodes of the subtree in preorder.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def getparent(self):
+        return self.parent
+
+    def index(self, child):
+        return self.children.index(child)
+
+    def itersiblings(self):
+        """
+        iterate over the following siblings.
+        """
+        if self.parent is None:
+            return iter([])
+        siblings = self.parent.children
+        return iter(siblings[siblings.index(self) + 1:])
+
+    def insert(self, i, node):
+        node.parent = self
+        self.children.insert(i, node)
+        # mark the path up to the root
+        ancestor = self
+        while ancestor is not None:
+            ancestor.modified = True
+            ancestor.version += 1
+            ancestor._compact_tree = None
+            ancestor = ancestor.parent
+
+    def compact_tree(self):
+        """
+        get the ``CompactTree`` of the subtree, its elements are the nodes.
+        """
+        if self._compact_tree is None:
+            self._compact_tree = CompactTree(self)
+        return self._compact_tree
+
+    def materialize(self):
+        """
+        build the lxml tree of the subtree.
+        """
+        if not self.modified:
+            return copy.deepcopy(self.source)
+        element = self.source.makeelement(self.source.tag, self.source.attrib, self.source.nsmap)
+        element.text = self.source.text
+        element.tail = self.source.tail
+        for child in self.children:
+            element.append(child.materialize())
+        return element
+
+class SeedIndex(object):
+    """
+    An index of the elements of the seed record, kept up to date as the partial
+    tree aligner inserts elements in the seed.
+
+    The position of each element within its parent is kept, so it's looked up in
+    constant time, and an insertion only shifts the positions of the following
+    siblings. The index is built lazily: the positions of the children of an
+    element are indexed when the position of one of them is first looked up, and
+    the elements are numbered in order of their first lookup, so the nodes of a
+    virtual seed are only created where the seed is aligned.
+
+    >>> from lxml.html import fragment_fromstring
+    >>> from .mdr import Record
+    >>> t = fragment_fromstring("<p> <a></a> <b></b> </p>")
+    >>> index = SeedIndex(Record(t))
+    >>> index.insert(t, 1, fragment_fromstring("<c><d></d></c>"))
+    >>> [e.tag for e in t], [index.position(e) for e in t]
+    (['a', 'c', 'b'], [0, 1, 2])
+    >>> [(e.tag, index.id(e)) for e in t.iter()]
+    [('p', 0), ('a', 1), ('c', 2), ('d', 3), ('b', 4)]
+    """
+
+    def __init__(self, seed):
+        self.seed = seed
+        # the number of each element, in order of lookup
+        self.ids = {}
+        # the position of the children of the indexed parents within them
+        self.positions = {}
+        self._parents = set()
+
+    def id(self, element):
+        """
+        get the number of the element, numbered when it's first looked up.
+        """
+        return self.ids.setdefault(element, len(self.ids))
+
+    def position(self, element):
+        """
+        get the position of the element within its parent.
+        """
+        position = self.positions.get(element)
+        if position is None:
+            parent = element.getparent()
+            if parent is None:
+                return 0
+            self._parents.add(parent)
+            for k, child in enumerate(parent):
+                self.positions[child] = k
+            position = self.positions[element]
+        return position
+
+    def insert(self, parent, position, element):
+        """
+        insert the element in the seed as the child of ``parent`` at ``position``.
+        """
+        parent.insert(position, element)
+        if parent in self._parents:
+            for sibling in element.itersiblings():
+                self.positions[sibling] += 1
+            self.positions[element] = position
+
+    def insert_copy(self, parent, position, element):
+        """
+        insert a copy of the element in the seed and return it, the copy is a ``SeedNode``
+        referring to the element in a virtual seed tree, a deep copy otherwise.
+        """
+        element_copy = SeedNode(element) if isinstance(parent, SeedNode) else copy.deepcopy(element)
+        self.insert(parent, position, element_copy)
+        return element_copy
+
+class PartialTreeAligner(object):
+    """
+    Align DOM trees partially, inserting the unaligned elements in the seed.
+
+    Parameters
+    ----------
+    memo: ``SimilarityMemo``, optional
+        keep the alignment score of the subtrees by their fingerprint.
+
+    native: bool
+        align the trees with ``NativeTreeAligner`` rather than ``SimpleTreeAligner``,
+        the mapping is the same.
+
+    cache: ``AlignmentCache``, optional
+        keep the alignments of the subtrees of a virtual seed across the calls.
+    """
+
+    def __init__(self, memo=None, native=False, cache=None):
+        self.sta = NativeTreeAligner(memo, cache) if native else SimpleTreeAligner(memo, cache)
+
+    def align_records(self, r1, r2, index=None):
         """
         partial align DOM tree list to another DOM tree list.
 
+        The unaligned elements of ``r2`` are inserted in ``r1`` where their position
+        is unique. ``index`` is the ``SeedIndex`` of ``r1``, which is kept up to date with
+        the insertions and can be passed to the next calls, it's built if not given.
+
         e.g. (taken from [1]):
 
         >>> from lxml.html import fragment_fromstring
@@ -207,18 +691,21 @@ class PartialTreeAligner(object):
         <http://dl.acm.org/citation.cfm?id=1060761>
 
         """
+        if index is None:
+            index = SeedIndex(r1)
+
         alignment = self.sta.align_records(r1, r2)
         aligned = {alignment.first: alignment.second}
+        # add reverse mapping too
+        reverse_aligned = {alignment.second: alignment.first}
 
-        for sub in alignment.subs:
+        for sub in alignment.iter_subs():
             aligned[sub.first] = sub.second
-
-        # add reverse mapping too
-        reverse_aligned = reverse_dict(aligned)
+            reverse_aligned[sub.second] = sub.first
 
         modified = False
 
-        unaligned_elements = self.find_unaligned_elements(aligned, r2)
+        unaligned_elements = self._find_unaligned_elements(reverse_aligned, r2)
         for l in unaligned_elements:
             left_most = l[0]
             right_most = l[-1]
@@ -231,18 +718,17 @@ class PartialTreeAligner(object):
                     # leftmost alignment
                     next_sibling_match = reverse_aligned.get(next_sibling, None)
                     for i, element in enumerate(l):
-                        element_copy = copy.deepcopy(element)
-                        next_sibling_match.getparent().insert(i, element_copy)
+                        element_copy = index.insert_copy(next_sibling_match.getparent(), i, element)
                         aligned.update({element_copy: element})
                     modified = True
             elif next_sibling is None:
                 # rightmost alignment
                 prev_sibling_match = reverse_aligned.get(prev_sibling, None)
-                previous_match_index = self._get_index(prev_sibling_match)
+                previous_match_index = index.position(prev_sibling_match)
                 # unique insertion
                 for i, element in enumerate(l):
-                    element_copy = copy.deepcopy(element)
-                    prev_sibling_match.getparent().insert(previous_match_index + 1 + i, element_copy)
+                    element_copy = index.insert_copy(prev_sibling_match.getparent(), previous_match_index + 1 + i,
+                                                     element)
                     aligned.update({element_copy: element})
                 modified = True
             else:
@@ -251,13 +737,13 @@ class PartialTreeAligner(object):
                 next_sibling_match = reverse_aligned.get(next_sibling, None)
 
                 if prev_sibling_match is not None and next_sibling_match is not None:
-                    next_match_index = self._get_index(next_sibling_match)
-                    previous_match_index = self._get_index(prev_sibling_match)
+                    next_match_index = index.position(next_sibling_match)
+                    previous_match_index = index.position(prev_sibling_match)
                     if next_match_index - previous_match_index == 1:
                         # unique insertion
                         for i, element in enumerate(l):
-                            element_copy = copy.deepcopy(element)
-                            prev_sibling_match.getparent().insert(previous_match_index + 1 + i, element_copy)
+                            element_copy = index.insert_copy(prev_sibling_match.getparent(),
+                                                             previous_match_index + 1 + i, element)
                             aligned.update({element_copy: element})
                         modified = True
         return modified, len(unaligned_elements) > 0, aligned
@@ -277,7 +763,11 @@ class PartialTreeAligner(object):
         >>> [[e.tag for e in l] for l in unaligned]
         [['h3', 'h4'], ['h6']]
         """
-        predicate = lambda x: x not in set(aligned.values())
+        return self._find_unaligned_elements(set(aligned.itervalues()), elements)
+
+    def _find_unaligned_elements(self, aligned, elements):
+        # ``aligned`` is the collection of the aligned elements
+        predicate = lambda x: x not in aligned
         unaligned = []
 
         for element in elements:
@@ -288,9 +778,3 @@ class PartialTreeAligner(object):
                 unaligned.extend(find_continous_subsequence(child, predicate))
 
         return unaligned
-
-    def _get_index(self, element):
-        """
-        get the position of the element within the parent.
-        """
-        return element.getparent().index(element)
@@ -0,0 +1,112 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from mdr import MDR
+from mdr import cache as cache_module
+from mdr.cache import SQLiteSimilarityCache, TemplateCache
+
+from . import get_page
+
+class SQLiteSimilarityCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'similarity.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_compact(self):
+        cache = SQLiteSimilarityCache(self.path, max_entries=10)
+        cache.set_many(dict(((i, i + 1), 0.5) for i in range(8)))
+        self.assertEquals(8, len(cache))
+
+        cache.set_many(dict(((i, i + 1), 0.5) for i in range(8, 16)))
+        self.assertEquals(10, len(cache))
+
+        # another connection sees the same entries
+        other = SQLiteSimilarityCache(self.path, max_entries=10)
+        self.assertEquals(10, len(other.get_many([(i, i + 1) for i in range(16)])))
+        self.assertEquals({'hits': 10, 'misses': 6}, other.stats())
+
+    def test_get_many(self):
+        cache = SQLiteSimilarityCache(self.path)
+        n = 2 * cache.batch_size + 1
+        cache.set_many(dict(((2 ** 64 - i, i), i / float(n)) for i in range(1, n, 2)))
+
+        # the keys are looked up in several batches, with or without row values
+        expected = dict(((2 ** 64 - i, i), i / float(n)) for i in range(1, n, 2))
+        supported = cache_module._ROW_VALUES
+        for row_values in [True, False]:
+            cache_module._ROW_VALUES = row_values
+            try:
+                self.assertEquals(expected, cache.get_many([(2 ** 64 - i, i) for i in range(1, n)]))
+            finally:
+                cache_module._ROW_VALUES = supported
+        self.assertEquals({'hits': n // 2 * 2, 'misses': n // 2 * 2}, cache.stats())
+
+    def test_access_times(self):
+        cache = SQLiteSimilarityCache(self.path, touch_interval=60)
+        cache.set_many({(1, 2): 0.5, (3, 4): 0.5})
+        cache.conn.execute('UPDATE similarity SET used = 0')
+
+        # the lookups don't write, the stale access times are written with the next set_many
+        cache.get_many([(1, 2)])
+        used = lambda: dict(((h1, h2), used > 0) for h1, h2, used in cache.conn.execute('SELECT h1, h2, used FROM similarity'))
+        self.assertEquals({(1, 2): False, (3, 4): False}, used())
+        cache.set_many({(5, 6): 0.5})
+        self.assertEquals({(1, 2): True, (3, 4): False, (5, 6): True}, used())
+
+        # a failed write is rolled back
+        self.assertRaises(sqlite3.IntegrityError, cache.set_many, {(7, 8): None})
+        cache.set_many({(7, 8): 0.5})
+        self.assertEquals(4, len(cache))
+
+    def test_similarity_matrix(self):
+        page = get_page('htmlpage1')
+        candidates, doc = MDR().list_candidates(page, 'utf8')
+        expected = MDR().calculate_similarity_matrix(candidates[0])
+
+        cache = SQLiteSimilarityCache(self.path)
+        for _ in range(2):
+            mdr = MDR(similarity_cache=cache)
+            m = mdr.calculate_similarity_matrix(candidates[0])
+            self.assertTrue((expected == m).all())
+
+        # the second time all the similarities come from the cache
+        self.assertEquals(cache.hits, cache.misses)
+
+class TemplateCacheTest(unittest.TestCase):
+
+    def test_extract_page(self):
+        mdr = MDR(template_cache=TemplateCache())
+        page0, page1 = get_page('htmlpage0'), get_page('htmlpage1')
+
+        candidate, seed_record, mappings = mdr.extract_page(page1)
+        self.assertEquals(30, len(mappings))
+        self.assertEquals(1, len(mdr.template_cache))
+
+        # the same template, the cached candidate and seed are used
+        candidate, seed_record, mappings = mdr.extract_page(page1)
+        self.assertEquals('reviews', candidate.get('id'))
+        self.assertEquals(30, len(mappings))
+        self.assertEquals({'hits': 1, 'misses': 1, 'failures': 0}, dict((k, mdr.template_cache.stats()[k]) for k in ('hits', 'misses', 'failures')))
+
+        # the cached location fails validation, the page is fully detected
+        key = mdr.template_cache.fingerprint(mdr.parse(page0)[0])
+        mdr.template_cache.set(key, '/html/body/missing', None)
+        candidate, seed_record, mappings = mdr.extract_page(page0)
+        self.assertEquals(40, len(mappings))
+        self.assertEquals(1, mdr.template_cache.failures)
+        self.assertNotEquals('/html/body/missing', mdr.template_cache.get(key)[0])
+
+    def test_eviction(self):
+        cache = TemplateCache(max_entries=2)
+        for key in range(3):
+            cache.set(key, '/html', None)
+        self.assertEquals(None, cache.get(0))
+        self.assertEquals(2, len(cache))
+        self.assertEquals(1, cache.stats()['evictions'])
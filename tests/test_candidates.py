@@ -0,0 +1,38 @@
+import collections
+import operator
+import unittest
+from cStringIO import StringIO
+
+from lxml import etree
+
+from mdr.candidates import find_candidates
+from mdr.utils import simplify_xpath, common_prefix
+
+from . import get_page
+
+def xpath_candidates(doc):
+    # the ranking by xpath strings find_candidates replaces
+    d = {}
+    for e in doc.xpath('//*/text()[normalize-space()]'):
+        xpath = doc.getpath(e.getparent())
+        d.setdefault(simplify_xpath(xpath), []).append(xpath)
+
+    counter = collections.Counter()
+    for key, elements in d.iteritems():
+        counter["/".join(common_prefix(*[xpath.split('/') for xpath in elements]))] += 1
+
+    return [doc.xpath(k)[0] for k, v in sorted(counter.items(), key=operator.itemgetter(1), reverse=True)]
+
+class FindCandidatesTest(unittest.TestCase):
+
+    def test_same_ranking(self):
+        pages = [get_page(name) for name in ('htmlpage0', 'htmlpage1', 'fragment0', 'fragment1', 'fragment2')]
+        pages.append(u"<html><body><!--c--> x<?pi a?> y<p>t<!--d-->z</p>&amp; e"
+                     "<div><span>a</span><span>b</span> tail</div><div> \t</div></body></html>")
+
+        for page in pages:
+            doc = etree.parse(StringIO(page.encode('utf8')), etree.HTMLParser(encoding='utf8'))
+            self.assertEquals(xpath_candidates(doc), find_candidates(doc))
+
+if __name__ == '__main__':
+    unittest.main()
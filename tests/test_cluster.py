@@ -0,0 +1,37 @@
+import unittest
+
+import numpy as np
+
+from mdr import MDR
+from mdr.cluster import get_backend, CondensedLinkage
+
+from . import get_page
+
+class ClusteringBackendTest(unittest.TestCase):
+
+    def test_backends(self):
+        page1 = get_page('htmlpage1')
+        candidates, doc = MDR().list_candidates(page1, 'utf8')
+        m = MDR().calculate_similarity_matrix(candidates[0])
+
+        for backend in ('legacy', 'condensed', 'graph'):
+            mdr = MDR(clustering=backend)
+            # first element is different from the rests
+            self.assertEquals(3, len(set(mdr.hcluster(m))))
+            seed_record, mappings = mdr.extract(candidates[0])
+            self.assertEquals(30, len(mappings))
+
+    def test_threshold(self):
+        m = np.array([[1, 0.5, 0], [0.5, 1, 0.2], [0, 0.2, 1]])
+        self.assertEquals([1, 2, 3], get_backend('condensed')(m, 0.4))
+        self.assertEquals([1, 1, 1], get_backend('graph')(m, 0.8))
+        # complete linkage needs all the pairs within the threshold
+        self.assertEquals([1, 1, 2], get_backend('condensed')(m, 0.8))
+
+        self.assertEquals([1], get_backend('condensed')(np.ones((1, 1)), 0.5))
+        self.assertRaises(ValueError, get_backend, 'kmeans')
+        # a backend class is instantiated
+        self.assertEquals([1, 1, 2], get_backend(CondensedLinkage)(m, 0.8))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from lxml.html import fragment_fromstring
+
+from mdr import MDR
+from mdr.lsh import MinHashLSH
+from mdr._tree import CompactTree
+
+from . import get_page
+
+class MinHashLSHTest(unittest.TestCase):
+
+    def test_buckets(self):
+        page = get_page('htmlpage1')
+        candidates, doc = MDR().list_candidates(page, 'utf8')
+        tree = CompactTree(candidates[0])
+        buckets = MinHashLSH().buckets(tree, tree.child_nodes(0))
+
+        # the first element is different from the rests, the records share a bucket
+        self.assertEquals(0, buckets[0])
+        self.assertEquals(1, buckets[1])
+        self.assertEquals(1, len(set(buckets[1::2])))
+
+    def test_similarity_matrix(self):
+        page = get_page('htmlpage1')
+        candidates, doc = MDR().list_candidates(page, 'utf8')
+        expected = MDR().calculate_similarity_matrix(candidates[0])
+
+        mdr = MDR(lsh=MinHashLSH(min_children=0))
+        m, report = mdr.calculate_similarity_matrix(candidates[0], report=True)
+        self.assertTrue(report['approximated'] > 0)
+        self.assertEquals(3, len(set(mdr.hcluster(m))))
+
+        seed_record, mappings = mdr.extract(candidates[0])
+        self.assertEquals(30, len(mappings))
+
+        # narrow candidates are matched exactly
+        m, report = MDR(lsh=MinHashLSH()).calculate_similarity_matrix(candidates[0], report=True)
+        self.assertEquals(0, report['approximated'])
+        self.assertTrue((m == expected).all())
+
+    def test_homogeneous_list(self):
+        n = 200
+        html = '<ul>%s</ul>' % ''.join('<li><a>%d</a><span>text</span><p><b>b</b></p></li>' % i for i in range(n))
+        element = fragment_fromstring(html)
+
+        mdr = MDR(lsh=MinHashLSH(min_children=0))
+        m, report = mdr.calculate_similarity_matrix(element, report=True)
+        # each child is only matched to itself and to the representative of its bucket
+        self.assertEquals(2 * n - 1, report['matched'])
+        self.assertTrue(report['matched'] < n * n)
+        self.assertTrue((m == MDR().calculate_similarity_matrix(element)).all())
+
+if __name__ == '__main__':
+    unittest.main()
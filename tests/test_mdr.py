@@ -1,9 +1,19 @@
+import os
+import pickle
 import unittest
+from lxml import etree
+import lxml.html
 from lxml.html import fragment_fromstring
 from mdr import MDR, Record
+from mdr import mdr as mdr_module
 
 from . import get_page
 
+class ExitingEncoding(str):
+    # kills the worker process that parses a page with it
+    def __hash__(self):
+        os._exit(1)
+
 def assert_element(expected_tag, expected_class, expected_id, element):
     assert expected_tag == element.tag
     assert expected_class == element.attrib.get('class', '')
@@ -22,6 +32,48 @@ class MdrTest(unittest.TestCase):
         candidates, doc = mdr.list_candidates(page1, 'utf8')
         assert_element('div', "tab-pane fade in active", 'reviews', candidates[0])
 
+    def test_detect_parsed(self):
+        mdr = MDR()
+        page = get_page('htmlpage0')
+        candidates, doc = mdr.list_candidates(page, 'utf8')
+        expected = [doc.getpath(c) for c in candidates]
+
+        body = page.encode('utf8')
+        for html in (body, memoryview(body), bytearray(body), doc):
+            candidates, doc = mdr.list_candidates(html)
+            self.assertEquals(expected, [doc.getpath(c) for c in candidates])
+
+        # a parsed page is not parsed again
+        candidates, same_doc = mdr.list_candidates(doc)
+        self.assertTrue(same_doc is doc)
+        self.assertEquals(1, len(mdr._parsers))
+
+        # the best candidate of a page is extracted
+        seed_record, mappings = mdr.extract(body)
+        self.assertEquals(40, len(mappings))
+        self.assertEquals((None, {}), mdr.extract(''))
+
+    def test_iter_extract(self):
+        mdr = MDR()
+        page1 = get_page('htmlpage1')
+        candidates, doc = mdr.list_candidates(page1, 'utf8')
+
+        ranked = list(mdr.iter_candidates(doc))
+        self.assertEquals(candidates, [c for c, score in ranked])
+        self.assertEquals(sorted([score for c, score in ranked], reverse=True), [score for c, score in ranked])
+
+        # the first candidate passes
+        results = list(mdr.iter_extract(doc))
+        self.assertEquals(1, len(results))
+        self.assertTrue(results[0]['passed'])
+        self.assertTrue(results[0]['candidate'] is candidates[0])
+        self.assertEquals(30, len(results[0]['mappings']))
+
+        # no candidate passes, only the budget stops
+        results = list(mdr.iter_extract(doc, min_confidence=1.1, max_candidates=3))
+        self.assertEquals(3, len(results))
+        self.assertFalse(any(r['passed'] for r in results))
+
     def test_cluster(self):
         mdr = MDR()
 
@@ -36,6 +88,23 @@ class MdrTest(unittest.TestCase):
         # first element is different from the rests
         self.assertEquals(3, len(set(mdr.hcluster(m))))
 
+    def test_similarity_matrix_threads(self):
+        page = get_page('htmlpage0')
+        candidates, doc = MDR().list_candidates(page, 'utf8')
+
+        mdr = MDR()
+        m = mdr.calculate_similarity_matrix(candidates[0])
+        with MDR(n_threads=4) as threaded_mdr:
+            threaded_m = threaded_mdr.calculate_similarity_matrix(candidates[0])
+            self.assertTrue(threaded_mdr._pool is not None)
+        self.assertTrue(threaded_mdr._pool is None)
+        self.assertTrue((m == threaded_m).all())
+        self.assertEquals(dict(mdr.tree_sim_cache.iteritems()), dict(threaded_mdr.tree_sim_cache.iteritems()))
+
+        # the pool is started again after close
+        threaded_mdr.calculate_similarity_matrix(candidates[0])
+        threaded_mdr.close()
+        self.assertTrue(threaded_mdr._pool is None)
 
     def test_extract(self):
         mdr = MDR()
@@ -96,6 +165,66 @@ class MdrTest(unittest.TestCase):
         self.assertEquals(extracted_dates[0], '2014-07-02')
         self.assertEquals(extracted_dates[-1], '2014-05-18')
 
+    def test_extract_with_serialized_seed(self):
+        mdr = MDR()
+
+        page = get_page('htmlpage0')
+        candidates, doc = mdr.list_candidates(page, 'utf8')
+        seed_record, mappings = mdr.extract(candidates[0])
+        dates = dict((e, 'date') for e in seed_record[0].iter() if e.get('itemprop') == 'datePublished')
+        self.assertEquals(1, len(dates))
+
+        # the seed is learned once and shipped as a string
+        seed_record = pickle.loads(pickle.dumps(Record.loads(seed_record.dumps(dates))))
+
+        fragment = fragment_fromstring(get_page('fragment0'))
+        seed_record_copy, mappings = mdr.extract(fragment, seed_record)
+        self.assertEquals(40, len(mappings))
+
+        extracted_dates = []
+        for record, mapping in mappings.iteritems():
+            for k, v in mapping.iteritems():
+                if seed_record_copy.fields.get(k) == 'date':
+                    extracted_dates.append(v.attrib.get('content'))
+
+        self.assertEquals(extracted_dates[0], '2014-07-02')
+        self.assertEquals(extracted_dates[-1], '2014-05-18')
+
+    def test_pickle_record(self):
+        tree = etree.fromstring('<!DOCTYPE li [<!ENTITY nbsp "">]><li id="x">a&nbsp;b<?pi data?><!--c--><span itemprop="price">1</span></li>',
+                                etree.XMLParser(resolve_entities=False))
+        record = Record(fragment_fromstring('<div class="a" title="t">text</div>'), tree)
+        record.fields = {tree[3]: 'price'}
+
+        copied = pickle.loads(pickle.dumps(record))
+        self.assertEquals([etree.tostring(t) for t in record], [etree.tostring(t) for t in copied])
+        self.assertEquals([type(e) for t in record for e in t.iter()], [type(e) for t in copied for e in t.iter()])
+        self.assertEquals({copied[1][3]: 'price'}, copied.fields)
+
+        # the HTML that isn't well-formed XML
+        html = lxml.html.fromstring('<div><p>a &amp; b<br>c<!-- d --><input value="x" checked></div>')
+        copied = pickle.loads(pickle.dumps(Record(html)))
+        self.assertEquals(lxml.html.tostring(html), lxml.html.tostring(copied[0]))
+        self.assertEquals([type(e) for e in html.iter()], [type(e) for e in copied[0].iter()])
+
+        # only the structure is serialized
+        loaded = Record.loads(record.dumps())
+        self.assertEquals([(type(e), e.tag) for e in tree.iter()], [(type(e), e.tag) for e in loaded[1].iter()])
+        self.assertEquals('nbsp', loaded[1][0].name)
+        self.assertEquals('pi', loaded[1][1].target)
+
+    def test_seed_clusters(self):
+        mdr = MDR()
+        element = fragment_fromstring("<div><p><a/></p><span/><p><a/><b/></p><em/><p><a/></p></div>")
+        record = Record(fragment_fromstring("<p><a/></p>"), fragment_fromstring("<span/>"))
+
+        # the children matching no seed tree are in cluster 0
+        self.assertEquals([0, 1, 0, 0, 0], mdr.seed_clusters(element, record))
+        # the encoded seed trees are reused for the same record
+        seed = mdr._seed
+        mdr.seed_clusters(element, record)
+        self.assertTrue(seed is mdr._seed)
+
     def test_extract_with_seed2(self):
 
         mdr = MDR()
@@ -127,5 +256,127 @@ class MdrTest(unittest.TestCase):
         self.assertEquals(extracted_texts[0], 'Kwaliteit van het eten matig')
         self.assertEquals(extracted_texts[-1], 'Paviljoen Strand 90 te Domburg is een uiterst sfeervol restaurant. De inrichting is smaakvol met mooie kleuren. De bediening is vriendelijk en behulpzaam. Het eten was lekker. Kortom, we zullen er zeker terug komen.')
 
+    def test_pruned_similarity_matrix(self):
+        page1 = get_page('htmlpage1')
+        candidates, doc = MDR().list_candidates(page1, 'utf8')
+        expected = MDR().calculate_similarity_matrix(candidates[0])
+
+        m, report = MDR(prune=True, clustering='condensed').calculate_similarity_matrix(candidates[0], report=True)
+        self.assertEquals(1770, report['pairs'])
+        self.assertEquals(870, report['pruned'])
+        self.assertTrue((m == expected).all())
+
+        # with threshold 0 every pair is pruned, the bounds are never below the similarity
+        m, report = MDR(prune='bound', threshold=0, clustering='graph').calculate_similarity_matrix(candidates[0], report=True)
+        self.assertTrue((m >= expected).all())
+
+        # the pruned pairs are never linked, the clusters are the same
+        for clustering in ['condensed', 'graph']:
+            expected = MDR(clustering=clustering).extract(candidates[0])[1]
+            seed_record, mappings = MDR(prune=True, clustering=clustering).extract(candidates[0])
+            self.assertEquals(len(expected), len(mappings))
+
+        # the legacy clustering compares whole rows of the matrix
+        with self.assertRaises(ValueError):
+            MDR(prune=True)
+
+    def test_sample_clusters(self):
+        page1 = get_page('htmlpage1')
+        candidates, doc = MDR().list_candidates(page1, 'utf8')
+
+        mdr = MDR(sample_size=20)
+        clusters = mdr.sample_clusters(candidates[0])
+        self.assertEquals(len(candidates[0]), len(clusters))
+        # the same seed gives the same clusters
+        self.assertEquals(clusters, MDR(sample_size=20).sample_clusters(candidates[0]))
+
+        # the records are separated by the same kind of <div>
+        self.assertEquals(1, len(set(clusters[1::2])))
+        self.assertEquals(1, len(set(clusters[2::2])))
+
+        mdr = MDR(sample_size=20)
+        seed_record, mappings = mdr.extract(candidates[0])
+        self.assertEquals(30, len(mappings))
+        # only the matrix of the sample is kept
+        self.assertEquals(20 * 20, len(mdr.tree_sim_cache))
+
+        # the linkage of the sample needs a pair
+        for sample_size in [0, 1]:
+            with self.assertRaises(ValueError):
+                MDR(sample_size=sample_size)
+        clusters = MDR(sample_size=2).sample_clusters(candidates[0])
+        self.assertEquals(len(candidates[0]), len(clusters))
+
+    def test_tree_sim_cache(self):
+        mdr = MDR(cache_size=100)
+
+        page = get_page('htmlpage1')
+        candidates, doc = mdr.list_candidates(page, 'utf8')
+        seed_record, mappings = mdr.extract(candidates[0])
+        self.assertEquals(30, len(mappings))
+
+        # a bigger matrix can exceed the size but keeps all its entries
+        n = len(candidates[0])
+        self.assertEquals(n * n, len(mdr.tree_sim_cache))
+
+        # the whole matrix of the previous candidate is evicted
+        mdr.calculate_similarity_matrix(candidates[1])
+        self.assertEquals(len(candidates[1]) ** 2, len(mdr.tree_sim_cache))
+
+        # the entries of previous documents are dropped
+        fragment = fragment_fromstring(get_page('fragment2'))
+        mdr.extract(fragment)
+        self.assertEquals(len(fragment) ** 2, len(mdr.tree_sim_cache))
+
+    def test_extract_many(self):
+        mdr = MDR()
+        pages = [(get_page('htmlpage0'), 'utf8'), (get_page('htmlpage1'), 'utf8')] * 2
+
+        results = list(mdr.extract_many(pages, processes=2, chunksize=1, max_pending=1))
+        self.assertEquals([0, 1, 2, 3], [r['index'] for r in results])
+        self.assertEquals([40, 30, 40, 30], [len(r['records']) for r in results])
+        self.assertEquals('/html/body/div[5]/div[2]/div[1]/div[1]/div[5]/div/div/div[1]', results[1]['candidate'])
+        self.assertEquals(2, len(results[1]['seed']))
+
+        for record in results[1]['records']:
+            self.assertEquals(len(results[1]['fields']), len(record['texts']))
+
+        results = list(mdr.extract_many(pages, processes=2, chunksize=3, ordered=False))
+        self.assertEquals([0, 1, 2, 3], sorted(r['index'] for r in results))
+
+        # a malformed page fails the chunk instead of blocking
+        for ordered in [True, False]:
+            with self.assertRaises(ValueError):
+                list(mdr.extract_many([(get_page('htmlpage1'),)], processes=1, ordered=ordered))
+
+        # and so does a worker that dies
+        for ordered in [True, False]:
+            with self.assertRaises(RuntimeError):
+                list(mdr.extract_many([(get_page('htmlpage1'), ExitingEncoding('utf8'))], processes=1,
+                                      ordered=ordered))
+        with self.assertRaises(mdr_module.TimeoutError):
+            list(mdr.extract_many(pages, processes=1, timeout=0.01))
+
+    def test_extract_many_options(self):
+        options = dict(threshold=0.1, clustering='graph', sample_size=8, random_state=1, prune=True,
+                       native_align=True, scheduler='benefit', max_rounds=2, memo_size=0)
+        pages = [(get_page('htmlpage0'), 'utf8'), (get_page('htmlpage1'), 'utf8')]
+        results = list(MDR(**options).extract_many(pages, processes=1))
+
+        # the same as extracting the pages in this process with the same options
+        mdr_module._worker_mdr = MDR(**options)
+        try:
+            expected = [mdr_module._extract_page(i, html, encoding) for i, (html, encoding) in enumerate(pages)]
+        finally:
+            mdr_module._worker_mdr = None
+        self.assertEquals(expected, results)
+        # and unlike the default options
+        mdr_module._worker_mdr = MDR()
+        try:
+            default = [mdr_module._extract_page(i, html, encoding) for i, (html, encoding) in enumerate(pages)]
+        finally:
+            mdr_module._worker_mdr = None
+        self.assertNotEquals(default, results)
+
 if __name__ == '__main__':
     unittest.main()
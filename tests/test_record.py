@@ -2,6 +2,8 @@ import unittest
 from lxml.html import etree
 
 from mdr import RecordAligner, Record
+from mdr.mappings import RecordMappings
+from mdr.tree import SeedNode
 
 t1 = etree.XML("""<root>
                     <a></a>
@@ -68,5 +70,93 @@ class RecordAlignerTest(unittest.TestCase):
                 expected.append(mapping[root].tag)
             self.assertEqual([tag] * 3, expected)
 
+    def test_mappings(self):
+        ra = RecordAligner()
+        seed_record = Record(t4)
+        records = [Record(t1), Record(t2), Record(t3)]
+        seed, mappings = ra.align(list(records), seed_record)
+
+        # the pairs of all the records are kept in flat arrays
+        self.assertTrue(isinstance(mappings, RecordMappings))
+        self.assertEqual([seed_record] + records, mappings.keys())
+        self.assertEqual(5 + 4 * 3, len(mappings.seed_nodes))
+
+        mapping = mappings.pop(seed_record)
+        self.assertEqual(5, len(mapping))
+        # the seed record is mapped to itself, the elements inserted in the seed are left out
+        self.assertEqual(list(seed_record[0].iter()), mapping.values())
+        self.assertEqual([e.tag for e in seed_record[0].iter()], [e.tag for e in mapping.keys()])
+        self.assertEqual(records, mappings.keys())
+        self.assertFalse(seed_record in mappings)
+        self.assertEqual(None, mappings.pop(seed_record, None))
+
+        d = seed[0].xpath('//d')[0]
+        for record, mapping in mappings.iteritems():
+            self.assertEqual(4, len(mapping))
+            self.assertFalse(d in mapping)
+            self.assertEqual(None, mapping.get(d))
+            self.assertEqual(record[0], mapping[seed[0]])
+            self.assertEqual([(k.tag, v.tag) for k, v in mapping.iteritems()],
+                             [('root', 'root'), ('a', 'a'), ('b', 'b'), ('c', 'c')])
+
+    def test_schedulers(self):
+        def align(**kwargs):
+            ra = RecordAligner(**kwargs)
+            seed_record = Record(etree.XML("<p><a/><b/><e/></p>"))
+            records = [Record(etree.XML("<p><a/><g/><e/></p>")), Record(etree.XML("<p><a/><b/><c/><d/><e/></p>"))]
+            seed, mappings = ra.align(records, seed_record)
+            stats = ra.stats()
+            self.assertTrue(stats.pop('time') >= 0)
+            return [e.tag for e in seed[0]], stats
+
+        # the first record can't be aligned until the seed is modified by the second one
+        self.assertEqual((['a', 'b', 'c', 'd', 'e'], {'iterations': 3, 'requeues': 1, 'dropped': 0}),
+                         align())
+        self.assertEqual((['a', 'b', 'c', 'd', 'e'], {'iterations': 2, 'requeues': 0, 'dropped': 1}),
+                         align(max_rounds=1))
+        # the first round is in order
+        self.assertEqual((['a', 'b', 'c', 'd', 'e'], {'iterations': 3, 'requeues': 1, 'dropped': 0}),
+                         align(scheduler='benefit'))
+        self.assertRaises(ValueError, RecordAligner, scheduler='lifo')
+
+    def test_virtual_seed(self):
+        ra = RecordAligner()
+        seed_record = Record(etree.XML("<p><a/><b/><e/></p>"))
+        records = [Record(etree.XML("<p><a/><b/><c><d/></c><e/></p>"))]
+        seed, mappings = ra.align(list(records), seed_record, materialize=False)
+
+        # the seed record is left as is, the virtual seed refers to the inserted elements
+        self.assertEqual(['a', 'b', 'e'], [e.tag for e in seed_record[0]])
+        self.assertTrue(isinstance(seed[0], SeedNode))
+        self.assertEqual(['p', 'a', 'b', 'c', 'd', 'e'], [e.tag for e in seed[0].iter()])
+        self.assertTrue(seed[0][2].source is records[0][0][2])
+        self.assertEqual(records[0][0][2], mappings[records[0]][seed[0][2]])
+
+        materialized = ra.materialize(seed)
+        self.assertEqual(etree.tostring(ra.align(list(records), seed_record)[0][0]),
+                         etree.tostring(materialized[0]))
+        self.assertEqual('<p><a/><b/><c><d/></c><e/></p>', etree.tostring(materialized[0]))
+
+    def test_alignment_cache(self):
+        subtree = '<a>' + '<li><span/><i/></li>' * 5 + '</a>'
+
+        def align(**kwargs):
+            # the first record is aligned again after each insertion at the end of the seed
+            ra = RecordAligner(**kwargs)
+            seed_record = Record(etree.XML('<div>%s<b/><e/></div>' % subtree))
+            records = [Record(etree.XML('<div>%s<g/><e/></div>' % subtree))]
+            records += [Record(etree.XML('<div>%s<b/><e/><c%d/></div>' % (subtree, k))) for k in range(3)]
+            seed, mappings = ra.align(list(records), seed_record)
+            return ra, etree.tostring(seed[0]), [sorted((k.tag, v.getroottree().getpath(v)) for k, v in mapping.iteritems())
+                                                 for mapping in mappings.itervalues()]
+
+        ra, seed, mappings = align()
+        self.assertEqual((seed, mappings), align(cache_size=0)[1:])
+        self.assertEqual(5, ra.stats()['iterations'])
+        # the alignments of the unmodified <a> subtree are reused, and dropped at the end
+        stats = ra.cache.stats()
+        self.assertTrue(stats['hits'] > 0)
+        self.assertEqual(0, stats['size'])
+
 if __name__ == '__main__':
     unittest.main()
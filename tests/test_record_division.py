@@ -1,6 +1,11 @@
+import itertools
 import unittest
 
+import numpy as np
+from lxml import etree
+
 from mdr import Record, RecordFinder
+from mdr.cache import TreeSimilarityCache
 
 def _create_similarity_cache(elements):
 
@@ -94,3 +99,45 @@ class RecordFinderTest(unittest.TestCase):
 
         records = rf.find_best_division(elements, clusters)
         self.assertIsNone(records)
+
+    def test_matrix_division(self):
+        names = ['a', 'b1', 'c1', 'b2', 'c2', 'b3']
+        doc = etree.XML('<div>%s</div>' % ''.join('<%s/>' % name[0] for name in names))
+        elements = doc.getchildren()
+        clusters = [0, 1, 2, 1, 2, 1]
+
+        pairs = _create_similarity_cache(names)
+        cache = TreeSimilarityCache()
+        cache.add_matrix(elements, np.array([[pairs[(n1, n2)] for n2 in names] for n1 in names]))
+        rf = RecordFinder(cache)
+
+        # the pairs of records are scored on the matrix of the cache, as with the pairs
+        records = rf.find_best_division(elements, clusters)
+        expected = RecordFinder(dict(((elements[names.index(n1)], elements[names.index(n2)]), sim)
+                                     for (n1, n2), sim in pairs.iteritems())).find_best_division(elements, clusters)
+        self.assertEquals([list(r) for r in expected], [list(r) for r in records])
+
+        similarities = rf.calculate_record_similarities(records)
+        self.assertEquals([rf.calculate_record_similarity(r1, r2) for r1, r2 in itertools.combinations(records, 2)],
+                          similarities)
+
+    def test_pruned_division(self):
+        elements = ['b%d' % i if i % 3 else 'a%d' % i for i in range(30)]
+        clusters = [1 if e[0] == 'a' else 2 for e in elements]
+        cache = _create_similarity_cache(elements)
+
+        # the divisions which can't beat the best one are not fully scored
+        rf = RecordFinder(cache)
+        rf.chunk_size = 1
+        expected = [list(r) for r in rf.find_best_division(elements, clusters)]
+        self.assertEquals(10, len(expected))
+        self.assertEquals(['a0', 'b1', 'b2'], expected[0])
+
+        # a sample of the pairs finds the same division
+        records = RecordFinder(cache, sample_pairs=10).find_best_division(elements, clusters)
+        self.assertEquals(expected, [list(r) for r in records])
+
+        # the bounds hold for the similarities up to 1, the larger ones are clipped
+        rf = RecordFinder(dict((pair, 2 * sim) for pair, sim in cache.iteritems()))
+        self.assertEquals(expected, [list(r) for r in rf.find_best_division(elements, clusters)])
+        self.assertEquals(0.5, rf.calculate_record_similarity(Record('a0'), Record('a3')))
@@ -1,8 +1,9 @@
 import unittest
 
 from lxml import etree
-from mdr._tree import _simple_tree_match
-from mdr.tree import clustered_tree_match
+from mdr._tree import _simple_tree_match, CompactTree, SimilarityMemo
+from mdr.tree import clustered_tree_match, SimpleTreeAligner, NativeTreeAligner, PartialTreeAligner, SeedIndex, SeedNode
+from mdr.mdr import Record
 
 s1 = """<root>
             <b>
@@ -48,3 +49,90 @@ class TreeMatchTest(unittest.TestCase):
         self.assertEquals(7, _simple_tree_match(tree1, tree2))
         self.assertEquals(0.375, clustered_tree_match(tree1, tree2))
 
+
+    def test_compact_tree_match(self):
+        tree1 = etree.XML(s1)
+        tree2 = etree.XML(s2)
+        self.assertEquals(7, _simple_tree_match(CompactTree(tree1), CompactTree(tree2)))
+        self.assertEquals(0.375, clustered_tree_match(CompactTree(tree1), CompactTree(tree2)))
+
+    def test_compact_tree_align(self):
+        tree1 = etree.XML(s1)
+        tree2 = etree.XML(s2)
+        sta = SimpleTreeAligner()
+        expected = sta.align_tree(tree1, tree2)
+        alignment = sta.align_tree(CompactTree(tree1), CompactTree(tree2))
+        self.assertEquals(expected.score, alignment.score)
+        self.assertEquals([(a.first, a.second) for a in expected.subs],
+                          [(a.first, a.second) for a in alignment.subs])
+
+    def test_memoized_tree_match(self):
+        tree1 = etree.XML(s1)
+        tree2 = etree.XML(s2)
+        memo = SimilarityMemo()
+        for _ in range(2):
+            self.assertEquals(7, _simple_tree_match(tree1, tree2, memo))
+            self.assertEquals(0.375, clustered_tree_match(tree1, tree2, memo=memo))
+        self.assertTrue(memo.hits > 0)
+
+        sta = SimpleTreeAligner()
+        memoized_sta = SimpleTreeAligner(memo)
+        expected = sta.align_tree(tree1, tree2)
+        for _ in range(2):
+            alignment = memoized_sta.align_tree(tree1, tree2)
+            self.assertEquals(expected.score, alignment.score)
+            self.assertEquals([(a.first, a.second) for a in expected.subs],
+                              [(a.first, a.second) for a in alignment.subs])
+
+    def test_native_tree_align(self):
+        tree1 = etree.XML(s1)
+        tree2 = etree.XML(s2)
+        expected = SimpleTreeAligner().align_tree(tree1, tree2)
+        for memo in [None, SimilarityMemo(), SimilarityMemo()]:
+            native = NativeTreeAligner(memo)
+            for _ in range(2):
+                alignment = native.align_tree(tree1, tree2)
+                self.assertEquals(expected.score, alignment.score)
+                self.assertEquals([(a.first, a.second) for a in expected.subs],
+                                  [(a.first, a.second) for a in alignment.subs])
+
+        r1, r2 = Record(*tree1), Record(*tree2)
+        expected = SimpleTreeAligner().align_records(r1, r2)
+        alignment = NativeTreeAligner().align_records(r1, r2)
+        self.assertEquals(expected.score, alignment.score)
+        self.assertEquals((expected.first, expected.second), (alignment.first, alignment.second))
+        self.assertEquals([(a.first, a.second) for a in expected.subs],
+                          [(a.first, a.second) for a in alignment.subs])
+
+    def test_native_partial_tree_align(self):
+        def align(native):
+            seed = Record(*etree.XML(s1))
+            record = Record(*etree.XML(s2))
+            modified, partial, aligned = PartialTreeAligner(native=native).align_records(seed, record)
+            mapping = sorted((etree.ElementTree(seed[0].getparent()).getpath(k), record[0].getroottree().getpath(v))
+                             for k, v in aligned.items())
+            return modified, partial, mapping
+
+        self.assertEquals(align(False), align(True))
+
+    def test_seed_index(self):
+        seed = Record(etree.XML("<p><a/><b/><e/></p>"))
+        index = SeedIndex(seed)
+        pta = PartialTreeAligner()
+        for s in ["<p><b/><c/><d/><e/></p>", "<p><f/><a/></p>", "<p><e/><g><h/></g></p>"]:
+            modified, partial, aligned = pta.align_records(seed, Record(etree.XML(s)), index)
+            self.assertTrue(modified)
+
+        self.assertEquals(['f', 'a', 'b', 'c', 'd', 'e', 'g'], [e.tag for e in seed[0]])
+        elements = list(seed[0].iter())
+        for e in elements[1:]:
+            self.assertEquals(e.getparent().index(e), index.position(e))
+        # the elements are numbered once
+        self.assertEquals(range(len(elements)), sorted(index.id(e) for e in elements))
+
+        # the children of a virtual seed are only created where it's aligned
+        seed = Record(SeedNode(etree.XML("<div><p><a/><b/></p><p><a/><b/></p></div>")))
+        index = SeedIndex(seed)
+        self.assertEquals(0, len(index.ids))
+        self.assertEquals(1, index.position(seed[0][1]))
+        self.assertTrue(seed[0][1]._children is None)